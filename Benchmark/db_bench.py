@@ -0,0 +1,131 @@
+import argparse, json, os, platform, socket, statistics, subprocess, sys, tempfile, threading, time
+from NP_hw3.TCP_tool import send_json, recv_json, client_hello
+
+# Requests/sec of DB_server in thread-per-connection vs event-loop mode.
+#   python -m NP_hw3.Benchmark.db_bench [--quick] [--clients 1 8 32] [--out result.json]
+# Each mode runs in its own server process on 127.0.0.1 over a throwaway
+# data directory; clients either keep one connection (like DB_pool) or
+# open one per request (the old DB_request).
+
+def free_port() -> int:
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def seed(data_dir: str, players: int):
+    accounts = {f"user{i}": {"password": "pw", "status": "offline", "token": "", "have_play": []}
+                for i in range(players)}
+    with open(os.path.join(data_dir, "player.json"), "w") as f:
+        json.dump(accounts, f)
+
+def start_server(mode: str, port: int, data_dir: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    p = subprocess.Popen([sys.executable, "-m", "NP_hw3.Server.DB_server", "--mode", mode,
+                          "--host", "127.0.0.1", "--port", str(port), "--allow", "127.0.0.1",
+                          "--data", data_dir], env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return p
+        except OSError:
+            time.sleep(0.05)
+    p.kill()
+    raise RuntimeError(f"DB server ({mode}) did not start")
+
+def query(i: int) -> dict:
+    return {"type": "player_db", "action": "query", "data": {"username": f"user{i % 100}"}}
+
+def client(port: int, persistent: bool, duration: float, lat: list, errors: list):
+    end = time.perf_counter() + duration
+    i = 0
+    sock = None
+    try:
+        while time.perf_counter() < end:
+            t = time.perf_counter()
+            if sock is None:
+                sock = socket.create_connection(("127.0.0.1", port))
+                # like framing_bench --tcp: measure the server, not Nagle / delayed ack
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if persistent:
+                    client_hello(sock)
+            send_json(sock, query(i))
+            recv_json(sock)
+            if not persistent:
+                sock.close()
+                sock = None
+            lat.append(time.perf_counter() - t)
+            i += 1
+    except OSError as e:
+        errors.append(repr(e))
+    finally:
+        if sock is not None:
+            sock.close()
+
+def run_case(port: int, clients: int, persistent: bool, duration: float) -> dict:
+    lats = [[] for _ in range(clients)]
+    errors = []
+    ths = [threading.Thread(target=client, args=(port, persistent, duration, lats[k], errors))
+           for k in range(clients)]
+    t0 = time.perf_counter()
+    for th in ths:
+        th.start()
+    for th in ths:
+        th.join()
+    elapsed = time.perf_counter() - t0
+    lat = sorted(x for l in lats for x in l)
+    n = len(lat)
+    return {
+        "clients": clients, "connection": "persistent" if persistent else "per-request",
+        "requests": n,
+        "req_per_sec": round(n / elapsed, 1),
+        "lat_us_p50": round(statistics.median(lat) * 1e6, 1) if n else None,
+        "lat_us_p99": round(lat[min(n - 1, int(n * 0.99))] * 1e6, 1) if n else None,
+        "errors": len(errors),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="DB_server front end benchmark")
+    ap.add_argument("--quick", action="store_true", help="shorter runs")
+    ap.add_argument("--clients", type=int, nargs="*", default=[1, 8, 32], help="concurrent clients")
+    ap.add_argument("--modes", nargs="*", default=["thread", "loop"])
+    ap.add_argument("--out", help="write the JSON result here instead of stdout")
+    args = ap.parse_args()
+
+    duration = 0.5 if args.quick else 3.0
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        seed(data_dir, 100)
+        for mode in args.modes:
+            port = free_port()
+            srv = start_server(mode, port, data_dir)
+            try:
+                for persistent in (True, False):
+                    for n in args.clients:
+                        r = dict(run_case(port, n, persistent, duration), mode=mode)
+                        results.append(r)
+                        print(f"[bench] {mode:<6} {r['connection']:<11} clients={n:<3} "
+                              f"{r['req_per_sec']:>9} req/s p50 {r['lat_us_p50']}us "
+                              f"p99 {r['lat_us_p99']}us err {r['errors']}", file=sys.stderr)
+            finally:
+                srv.terminate()
+                srv.wait()
+    report = {
+        "bench": "db_server",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "duration_s": duration,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
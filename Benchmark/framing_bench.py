@@ -0,0 +1,131 @@
+import argparse, json, platform, socket, statistics, sys, threading, time
+from NP_hw3 import TCP_tool, msgpack_codec
+from NP_hw3.TCP_tool import send_json, recv_json
+
+# Micro-benchmark of TCP_tool framing: frames/sec, MB/s and round-trip
+# latency per payload size, codec and compression setting.
+#   python -m NP_hw3.Benchmark.framing_bench [--quick] [--tcp] [--out result.json]
+# Output is one JSON document so runs can be diffed between releases.
+
+SIZES = [100, 1_000, 10_000, 100_000, 1_000_000, 4_000_000]
+QUICK_SIZES = [100, 10_000, 1_000_000]
+
+def make_payload(size: int) -> dict:
+    # store-like message: game entries with comment text, ~size bytes of json
+    games = {}
+    i = 0
+    approx = 2
+    while approx < size:
+        comment = ["nice game, would play again " * 2, f"player{i}", "2025-01-01 12:00:00"]
+        games[f"game{i}_dev"] = {"gamename": f"game{i}", "author": "dev", "version": "1.0.0",
+                                 "max_players": 2, "game_type": "CUI", "comments": [comment]}
+        approx += 190
+        i += 1
+    return {"action": "open_shop", "result": "ok", "data": {"games": games}, "msg": ""}
+
+def sock_pair(tcp: bool):
+    if not tcp:
+        return socket.socketpair()
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.bind(("127.0.0.1", 0))
+    srv.listen(1)
+    a = socket.create_connection(srv.getsockname())
+    b, _ = srv.accept()
+    srv.close()
+    for s in (a, b):
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return a, b
+
+def configure(a, b, codec: str, compress: bool):
+    for s in (a, b):
+        TCP_tool.configure(s, codec, compress)
+
+def run_case(payload: dict, size: int, codec: str, compress: bool, tcp: bool, budget: float) -> dict:
+    # throughput: one direction, receiver counts frames
+    a, b = sock_pair(tcp)
+    configure(a, b, codec, compress)
+    count = max(5, min(20000, int(budget * 200_000_000 / max(size, 1) / 20)))
+    wire0 = TCP_tool.ZSTATS_TOTAL.wire_out
+    def sender():
+        for _ in range(count):
+            send_json(a, payload)
+    t0 = time.perf_counter()
+    th = threading.Thread(target=sender)
+    th.start()
+    for _ in range(count):
+        recv_json(b)
+    elapsed = time.perf_counter() - t0
+    th.join()
+    wire = (TCP_tool.ZSTATS_TOTAL.wire_out - wire0) / count
+    a.close(); b.close()
+
+    # latency: ping-pong round trips
+    a, b = sock_pair(tcp)
+    configure(a, b, codec, compress)
+    rounds = max(5, min(2000, count // 2))
+    def echo():
+        for _ in range(rounds):
+            send_json(b, recv_json(b))
+    th = threading.Thread(target=echo)
+    th.start()
+    lat = []
+    for _ in range(rounds):
+        t = time.perf_counter()
+        send_json(a, payload)
+        recv_json(a)
+        lat.append((time.perf_counter() - t) * 1e6)
+    th.join()
+    a.close(); b.close()
+    lat.sort()
+    return {
+        "size": size, "codec": codec, "compress": compress,
+        "frames": count,
+        "frames_per_sec": round(count / elapsed, 1),
+        "mb_per_sec": round(count * size / elapsed / 1e6, 2),
+        "wire_bytes_per_msg": round(wire),
+        "rtt_us_p50": round(statistics.median(lat), 1),
+        "rtt_us_p99": round(lat[min(len(lat) - 1, int(len(lat) * 0.99))], 1),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="TCP_tool framing / codec benchmark")
+    ap.add_argument("--quick", action="store_true", help="fewer sizes, shorter runs")
+    ap.add_argument("--tcp", action="store_true", help="loopback TCP instead of socketpair")
+    ap.add_argument("--sizes", type=int, nargs="*", help="payload sizes in bytes")
+    ap.add_argument("--codecs", nargs="*", default=list(TCP_tool.CODEC_FLAGS), help="codecs to run")
+    ap.add_argument("--out", help="write the JSON result here instead of stdout")
+    args = ap.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    budget = 0.2 if args.quick else 1.0
+    results = []
+    for size in sizes:
+        payload = make_payload(size)
+        real = len(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        for codec in args.codecs:
+            for compress in (False, True):
+                r = run_case(payload, real, codec, compress, args.tcp, budget)
+                results.append(r)
+                print(f"[bench] {real:>9}B {codec:<8} zlib={'on ' if compress else 'off'} "
+                      f"{r['frames_per_sec']:>10} f/s {r['mb_per_sec']:>8} MB/s "
+                      f"p50 {r['rtt_us_p50']}us p99 {r['rtt_us_p99']}us", file=sys.stderr)
+    report = {
+        "bench": "framing",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "transport": "tcp-loopback" if args.tcp else "socketpair",
+        "msgpack_c": msgpack_codec.HAVE_FAST,
+        "max_frame": TCP_tool.MAX_FRAME,
+        "compress_min": TCP_tool.COMPRESS_MIN,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse, json, os, platform, shutil, sys, tempfile, time
+from NP_hw3.Server.DB_storage import JsonStorage, SqliteStorage
+
+# DB_server storage engines side by side: load, full save, and saving 1 / 100
+# changed records, per DB size.
+#   python -m NP_hw3.Benchmark.storage_bench [--quick] [--sizes 10000 100000] [--out result.json]
+# The engines are driven directly with player-like records (what DB does on
+# startup / flush / compaction), so the numbers are the disk cost only.
+
+SIZES = [10_000, 100_000, 1_000_000]
+QUICK_SIZES = [10_000]
+
+ENGINES = {
+    "json": lambda path: JsonStorage(path, ("status", "token")),
+    "json-seg64": lambda path: JsonStorage(path, ("status", "token"), segments=64),
+    "sqlite": lambda path: SqliteStorage(path, ("status", "token"), columns=("author",)),
+}
+
+def make_records(n: int) -> dict:
+    return {f"user{i}": {"password": "pw", "author": f"dev{i % 100}", "have_play": [f"game{i % 7}"],
+                         "status": "offline", "token": ""} for i in range(n)}
+
+def disk_size(dir_: str) -> int:
+    total = 0
+    for root, _, files in os.walk(dir_):
+        for f in files:
+            total += os.path.getsize(os.path.join(root, f))
+    return total
+
+def timed(fn) -> float:
+    t = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - t) * 1e3, 3)
+
+def run_case(engine: str, n: int, records: dict) -> dict:
+    dir_ = tempfile.mkdtemp(prefix="storage_bench_")
+    path = os.path.join(dir_, "player.json")
+    try:
+        st = ENGINES[engine](path)
+        st.load()
+        full_ms = timed(lambda: st.save(records, None, 0))
+        keys = [f"user{i}" for i in range(0, n, max(1, n // 100))][:100]
+        snap = dict(records)
+        for k in keys:
+            snap[k] = dict(snap[k], have_play=snap[k]["have_play"] + ["new"])
+        # incremental engines get the changed keys, the single file rewrites everything anyway
+        one_ms = timed(lambda: st.save(snap, {keys[0]} if st.incremental else None, 1))
+        hundred_ms = timed(lambda: st.save(snap, set(keys) if st.incremental else None, 2))
+        st.close()
+        st = ENGINES[engine](path)
+        loaded = {}
+        load_ms = timed(lambda: loaded.update(st.load()))
+        st.close()
+        assert len(loaded) == n, (engine, len(loaded))
+        return {"engine": engine, "records": n, "save_all_ms": full_ms, "save_1_ms": one_ms,
+                "save_100_ms": hundred_ms, "load_ms": load_ms, "disk_bytes": disk_size(dir_)}
+    finally:
+        shutil.rmtree(dir_, ignore_errors=True)
+
+def main():
+    ap = argparse.ArgumentParser(description="DB_server storage engine benchmark")
+    ap.add_argument("--quick", action="store_true", help="10k records only")
+    ap.add_argument("--sizes", type=int, nargs="*", help="DB sizes (records)")
+    ap.add_argument("--engines", nargs="*", default=list(ENGINES), choices=list(ENGINES))
+    ap.add_argument("--out", help="write the JSON result here instead of stdout")
+    args = ap.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    results = []
+    for n in sizes:
+        records = make_records(n)
+        for engine in args.engines:
+            r = run_case(engine, n, records)
+            results.append(r)
+            print(f"[bench] {engine:<10} {n:>8} records: save all {r['save_all_ms']:>10} ms, "
+                  f"1 changed {r['save_1_ms']:>9} ms, 100 changed {r['save_100_ms']:>9} ms, "
+                  f"load {r['load_ms']:>9} ms, {r['disk_bytes']} bytes", file=sys.stderr)
+    report = {
+        "bench": "db_storage",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
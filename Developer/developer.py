@@ -1,6 +1,6 @@
 from sympy import re
 from ..config import DEV_HOST, DEV_PORT
-from ..TCP_tool import set_keepalive, recv_json, send_json
+from ..TCP_tool import set_keepalive, recv_json, send_json, has_buffered, client_hello, send_files
 import threading
 import select
 import sys
@@ -36,6 +36,8 @@ class DEVELOPER():
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((DEV_HOST, DEV_PORT))
+            # agree on codec and compression (store/download payloads are large text)
+            client_hello(self.sock)
             self.main_route()
         except Exception as e:
             print("error_d")
@@ -229,23 +231,19 @@ class DEVELOPER():
                                                 print("Local config updated successfully.")
                                             except Exception as e:
                                                 print(f"Failed to update local config: {e}")
-                                            # 4. send update request to server (also the files)
+                                            # 4. send update request to server (the files follow it as streams)
                                             game_files = {}
                                             for file in game_dir.iterdir():
                                                 if file.is_file() and file.suffix in {".py", ".txt", ".md"}:
-                                                    try:
-                                                        with open(file, "r", encoding="utf-8") as gf:
-                                                            game_files[file.name] = gf.read()
-                                                    except Exception as e:
-                                                        print(f"Failed to read file {file.name}: {e}")
+                                                    game_files[file.name] = file
                                             # ensure developer upload
                                             upload_data = {
                                                 "username": self.username,
                                                 "gamename": gamename,
-                                                "files": game_files,
+                                                "files": list(game_files),
                                                 "config": new_config
                                             }
-                                            send_json(self.sock, format(status=self.status, action="update_game", data=upload_data, token=self.token))
+                                            send_files(self.sock, format(status=self.status, action="update_game", data=upload_data, token=self.token), game_files)
                                             recv_data = recv_json(self.sock)
                                             act, result, resp_data, self.last_msg = breakdown(recv_data)
                                             if act == "update_game" and result == "ok":
@@ -330,20 +328,19 @@ class DEVELOPER():
                                     with open(config_path, "w", encoding="utf-8") as cf:
                                         json.dump(config_data, cf, indent=4, ensure_ascii=False)
                                         time.sleep(0.1)
-                                    # read game files
+                                    # game files, sent after the request as streams
                                     game_files = {}
                                     for file in selected_game_dir.iterdir():
                                         if file.is_file() and file.suffix in {".py", ".txt", ".md"}:
-                                            with open(file, "r", encoding="utf-8") as gf:
-                                                game_files[file.name] = gf.read()
+                                            game_files[file.name] = file
                                     # prepare upload data
                                     upload_data = {
                                         "username": self.username,
                                         "gamename": gamename,
                                         "config": config_data,
-                                        "files": game_files
+                                        "files": list(game_files)
                                     }
-                                    send_json(self.sock, format(status=self.status, action="upload_game", data=upload_data, token=self.token))
+                                    send_files(self.sock, format(status=self.status, action="upload_game", data=upload_data, token=self.token), game_files)
                                     recv_data = recv_json(self.sock)
                                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                                     if act == "upload_game" and result == "ok":
@@ -505,8 +502,9 @@ def nb_input(prompt=">> ", default=None, conn=None):
     while True:
         # check server socket first
         if conn:
+            # frames already pulled into the reader buffer are invisible to select
             r, _, _ = select.select([conn], [], [], 0)
-            if r:
+            if r or has_buffered(conn):
                 try:
                     resp = recv_json(conn)
                     act, result, resp_data, last_msg = breakdown(resp)
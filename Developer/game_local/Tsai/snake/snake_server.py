@@ -1,30 +1,12 @@
 import socket
 import threading
-import json
 import argparse
 import random
 import time
 from typing import Dict, Any, Optional, Tuple, List
 
-# ---------- JSON helpers (same style as your templates) ----------
-def send_json(conn: socket.socket, obj: Dict[str, Any]) -> None:
-    data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
-    conn.sendall(data)
-
-def recv_json(conn: socket.socket) -> Optional[Dict[str, Any]]:
-    buf = b""
-    while True:
-        chunk = conn.recv(4096)
-        if not chunk:
-            return None
-        buf += chunk
-        if b"\n" in buf:
-            line, _rest = buf.split(b"\n", 1)
-            try:
-                return json.loads(line.decode("utf-8"))
-            except json.JSONDecodeError:
-                return None
-
+# ---------- JSON helpers (buffered, see NP_hw3/game_tool.py) ----------
+from NP_hw3.game_tool import send_json, recv_json
 
 # ---------- Game logic ----------
 DIRS = {
@@ -1,30 +1,7 @@
 import socket
-import json
 import sys
 from typing import Dict, Any, Optional
-
-
-def send_json(conn: socket.socket, obj: Dict[str, Any]) -> None:
-    data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
-    conn.sendall(data)
-
-
-def recv_json(conn: socket.socket) -> Optional[Dict[str, Any]]:
-    buf = b""
-    while True:
-        try:
-            chunk = conn.recv(4096)
-        except Exception:
-            return None
-        if not chunk:
-            return None
-        buf += chunk
-        if b"\n" in buf:
-            line, _rest = buf.split(b"\n", 1)
-            try:
-                return json.loads(line.decode("utf-8"))
-            except json.JSONDecodeError:
-                return None
+from NP_hw3.game_tool import send_json, recv_json
 
 
 def prompt_secret() -> str:
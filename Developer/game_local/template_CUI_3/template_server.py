@@ -1,40 +1,20 @@
 import socket
 import threading
-import json
 import argparse
 from typing import Dict, Any, Optional, Tuple, List
+from NP_hw3 import game_tool
+from NP_hw3.game_tool import recv_json
 
 
 def send_json(conn: socket.socket, obj: Dict[str, Any]) -> None:
     """Send a JSON object over a socket, terminated by a newline."""
-    data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
     try:
-        conn.sendall(data)
+        game_tool.send_json(conn, obj)
     except Exception:
         # If sending fails, ignore. The connection may already be closed.
         pass
 
 
-def recv_json(conn: socket.socket) -> Optional[Dict[str, Any]]:
-    """Receive a single JSON object delimited by a newline. If the connection
-    is closed before a complete line is received, return None."""
-    buf = b""
-    while True:
-        try:
-            chunk = conn.recv(4096)
-        except Exception:
-            return None
-        if not chunk:
-            return None
-        buf += chunk
-        if b"\n" in buf:
-            line, _rest = buf.split(b"\n", 1)
-            try:
-                return json.loads(line.decode("utf-8"))
-            except json.JSONDecodeError:
-                return None
-
-
 def count_ab(secret: str, guess: str) -> Tuple[int, int]:
     """Compute the nAnB result (A = correct digit and position, B = correct digit
     but wrong position) between a secret and a guess. Both inputs should be
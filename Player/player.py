@@ -1,5 +1,5 @@
 from ..config import LOBBY_HOST, LOBBY_PORT
-from ..TCP_tool import set_keepalive, recv_json, send_json
+from ..TCP_tool import set_keepalive, client_hello, Dispatcher, file_sink
 import threading
 import select
 import sys
@@ -23,6 +23,7 @@ class PLAYER():
     # ======= setting ======= #
     def __init__(self):
         self.sock = None # connect with client server
+        self.rpc = None
         self.status = STATUS.INIT
         self.change_mode = False
         self.exit = False
@@ -38,6 +39,10 @@ class PLAYER():
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((LOBBY_HOST, LOBBY_PORT))
+            # agree on codec and compression (store/download payloads are large text)
+            client_hello(self.sock)
+            # owns the socket from here on: responses by req_id, pushes queued
+            self.rpc = Dispatcher(self.sock)
             self.main_route()
         except Exception as e:
             print(f"[!] {(LOBBY_HOST, LOBBY_PORT)} disconnected: {e}")
@@ -83,9 +88,7 @@ class PLAYER():
                     password = nb_input("Password: ")
 
                     request_data = {"username": username, "password": password}
-                    send_json(self.sock, format(status=self.status, action="register", data=request_data, token=None))
-
-                    recv_data = recv_json(self.sock)
+                    recv_data = self.rpc.request(format(status=self.status, action="register", data=request_data, token=None))
                     act, result, resp_data, self.last_msg = breakdown(recv_data)
 
                 # === login === #
@@ -96,8 +99,7 @@ class PLAYER():
                     password = nb_input("Password: ")
 
                     request_data = {"username": username, "password": password}
-                    send_json(self.sock, format(status=self.status, action="login", data=request_data, token=None))
-                    recv_data = recv_json(self.sock)
+                    recv_data = self.rpc.request(format(status=self.status, action="login", data=request_data, token=None))
                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                     
                     if act == "login" and result == "ok":
@@ -140,26 +142,45 @@ class PLAYER():
             match op:
                 case "1":# open game store
                     in_shop = True
+                    shop_orders = ["last_update", "name", "popularity"]
+                    shop_order = shop_orders[0]
+                    cursors = [None]  # cursor of every page seen so far, the last one is shown
                     while in_shop:
-                        send_json(self.sock, format(status=self.status, action="open_shop", data={}, token=self.token))
-                        recv_data = recv_json(self.sock)
+                        recv_data = self.rpc.request(format(status=self.status, action="open_shop", data={"order": shop_order, "cursor": cursors[-1]}, token=self.token))
                         act, result, resp_data, self.last_msg = breakdown(recv_data)
                         
-                        # list all games on the store, and ask user to choose one.
+                        # list one page of the store, and ask user to choose one.
                         if act == "open_shop" and result == "ok":
                             games = resp_data["games"]
-                            if games == {}:
+                            if games == {} and len(cursors) == 1:
                                 self.last_msg = "No games available in the store."
                                 break
-                            print("=== Game Store ===")
+                            print(f"=== Game Store (page {len(cursors)}, by {shop_order}) ===")
                             # enumerate games
                             for idx, (game_name, game_info) in enumerate(games.items(), start=1):
                                 print(f"{idx}. {game_info["gamename"]} - Author: {game_info['author']} - version: {game_info["version"]}")
                             print("------------------------------------")
+                            print("n: next page, p: previous page, s: change order")
                             print("Select one number, 0 for going back.")
                             op = nb_input(">> ")
                             if op == "0":
                                 break
+                            if op in ("n", "p", "s"):
+                                os.system('clear')
+                                if op == "n":
+                                    if resp_data.get("next"):
+                                        cursors.append(resp_data["next"])
+                                    else:
+                                        print("This is the last page.")
+                                elif op == "p":
+                                    if len(cursors) > 1:
+                                        cursors.pop()
+                                    else:
+                                        print("This is the first page.")
+                                else:
+                                    shop_order = shop_orders[(shop_orders.index(shop_order) + 1) % len(shop_orders)]
+                                    cursors = [None]
+                                continue
 
                             if not op.isdigit() or int(op) < 1 or int(op) > len(games):
                                 print("Invalid input, please try again.")
@@ -189,26 +210,18 @@ class PLAYER():
                                         print("----------------------------------------")
                                     case "2": # download game
                                         print(f"Downloading {game_info['gamename']}...")
-                                        send_json(self.sock, format(status=self.status, action="download_game", data={"gamename": game_name}, token=self.token))
-                                        recv_data = recv_json(self.sock)
+                                        # at DOWNLOAD PATH; the game files are written there as they arrive
+                                        target_dir = ensure_user_download_dir(self.username) / game_name
+                                        recv_data = self.rpc.request(format(status=self.status, action="download_game", data={"gamename": game_name}, token=self.token),
+                                                                     sink=file_sink(target_dir))
                                         act, result, resp_data, self.last_msg = breakdown(recv_data)
                                         if act == "download_game" and result == "ok":
-                                            # at DOWNLOAD PATH
-                                            # resp_data expected to contain files mapping and optional config
-                                            files = resp_data.get("files", {}) if isinstance(resp_data, dict) else {}
+                                            # resp_data expected to contain the config
                                             config = resp_data.get("config") if isinstance(resp_data, dict) else None
-                                            # use game_info gamename for folder name if available
-
-                                            target_dir = ensure_user_download_dir(self.username) / game_name
                                             os.makedirs(target_dir, exist_ok=True)
                                             with open(target_dir / "config.json", "w") as f:
                                                 json.dump(config, f, indent=4)
                                             
-                                            for filename, filecontent in resp_data['files'].items():
-                                                file_path = target_dir / filename
-                                                with open(file_path, "wb") as f:
-                                                    f.write(filecontent.encode('utf-8'))
-                                            
                                             print(f"Game {game_info['gamename']} downloaded successfully to {target_dir}!")
                                             in_shop = False
                                             break
@@ -216,25 +229,26 @@ class PLAYER():
                                             print("Failed to download the game.")
                                     case "3": # view comments
                                         os.system("clear")
-                                        if game_info["comments"] == []:
+                                        # the store list leaves comments out, ask for them now
+                                        recv_data = self.rpc.request(format(self.status, "get_comments", data={"gamename": game_name}, token=self.token))
+                                        act, result, resp_data, self.last_msg = breakdown(recv_data)
+                                        comment_list = resp_data.get("comments", []) if act == "get_comments" and result == "ok" else []
+                                        if comment_list == []:
                                             print("No comments on this game!")
                                         else:
-                                            idx = 1
-                                            for comments in game_info['comments']:
+                                            for idx, comments in enumerate(comment_list, start=1):
                                                 print(f"{idx}. {comments[0]} -- by [{comments[1]}] at {comments[2]}")
                                         _ = nb_input("Press Enter to continue", default="")
                                     case "4": # comment
                                         os.system("clear")
-                                        send_json(self.sock, format(self.status, "check_play", data={"gamename": game_name}, token=self.token))
-                                        recv_data = recv_json(self.sock)
+                                        recv_data = self.rpc.request(format(self.status, "check_play", data={"gamename": game_name}, token=self.token))
                                         act, result, resp_data, self.last_msg = breakdown(recv_data)
                                         if act == "check_play" and result == "ok":
 
                                             print("Enter your comment:")
                                             comment = nb_input(">>")
                                             os.system('clear')
-                                            send_json(self.sock, format(self.status, "submit", data={"gamename": game_name, "comment": comment}, token=self.token))
-                                            recv_data = recv_json(self.sock)
+                                            recv_data = self.rpc.request(format(self.status, "submit", data={"gamename": game_name, "comment": comment}, token=self.token))
                                             act, result, resp_data, self.last_msg = breakdown(recv_data)
                                             print(recv_data)
                                             if act == "submit" and result == "ok":
@@ -251,6 +265,9 @@ class PLAYER():
                                         os.system("clear")
                                         print("Invalid input, please try again.")
                                         print("----------------------")
+                        else:
+                            # last_msg holds the reason
+                            break
 
                 case "2":# play
                     GAME_FOLDER_PATH = ensure_user_download_dir(self.username)
@@ -258,10 +275,19 @@ class PLAYER():
                     if not available_games:
                         self.last_msg = "No downloaded games found. Please download a game first."
                         continue
+                    # pipeline check_version for every game, one round trip for the whole list
+                    version_checks = {}
+                    for game_dir in available_games:
+                        if (game_dir / "config.json").exists():
+                            with open(game_dir / "config.json", "r") as f:
+                                local_version = json.load(f).get("version")
+                            version_checks[game_dir.name] = self.rpc.submit(format(status=self.status, action="check_version", data={"gamename": game_dir.name, "version": local_version}, token=self.token))
                     print("=== Available Games List ===")
                     for idx, game_dir in enumerate(available_games, start=1):
                         game, author = game_dir.name.rsplit("_", 1)
-                        print(f"{idx}. {game}, by {author}")
+                        check = version_checks.get(game_dir.name)
+                        outdated = check is not None and check.result()["result"] != "ok"
+                        print(f"{idx}. {game}, by {author}" + ("  (update available)" if outdated else ""))
                     print("-------------------------------------")
                     print("0. go back")
                     print("Choose a game number to play")
@@ -279,12 +305,8 @@ class PLAYER():
                     if not config_path.exists():
                         print("config.json not found for the selected game. Cannot verify version.")
                         continue
-                    with open(config_path, "r") as f:
-                        config = json.load(f)
-                    local_version = config.get("version")
-                    # inform server to check version
-                    send_json(self.sock, format(status=self.status, action="check_version", data={"gamename": selected_game_dir.name, "version": local_version}, token=self.token))
-                    recv_data = recv_json(self.sock)
+                    # version already checked while listing
+                    recv_data = version_checks[selected_game_dir.name].result()
                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                     backtolobby = False
                     if act != "check_version" or result != "ok":
@@ -296,19 +318,14 @@ class PLAYER():
                             op = nb_input(">> ")
                             os.system('clear')
                             if op == "1":
-                                send_json(self.sock, format(status=self.status, action="download_game", data={"gamename": selected_game_dir.name}, token=self.token))
-                                recv_data = recv_json(self.sock)
+                                # overwrite existing files as they arrive
+                                recv_data = self.rpc.request(format(status=self.status, action="download_game", data={"gamename": selected_game_dir.name}, token=self.token),
+                                                             sink=file_sink(selected_game_dir))
                                 act, result, resp_data, self.last_msg = breakdown(recv_data)
                                 if act == "download_game" and result == "ok":
-                                    # overwrite existing files
                                     with open(config_path, "w") as f:
                                         json.dump(resp_data["config"], f, indent=4)
                                     
-                                    for filename, filecontent in resp_data["files"].items():
-                                        file_path = selected_game_dir / filename
-                                        with open(file_path, "wb") as f:
-                                            f.write(filecontent.encode('utf-8'))
-                                    
                                     print(f"Game {selected_game_dir.name} updated successfully!")
                                     break
                                 else:
@@ -336,8 +353,7 @@ class PLAYER():
                                 print("Set room password (or leave empty for no password)")
                                 room_password = nb_input(">> ", default="")
                                 os.system('clear')
-                                send_json(self.sock, format(status=self.status, action="create_room", data={"gamename": selected_game_dir.name, "room_password": room_password}, token=self.token))
-                                recv_data = recv_json(self.sock)
+                                recv_data = self.rpc.request(format(status=self.status, action="create_room", data={"gamename": selected_game_dir.name, "room_password": room_password}, token=self.token))
                                 act, result, resp_data, self.last_msg = breakdown(recv_data)
                                 if act == "create_room" and result == "ok":
                                     room_id = resp_data.get("room_id")
@@ -350,8 +366,7 @@ class PLAYER():
                                     print("Failed to create room. Try again.")
                             case "2": # Join room
                                 # List all rooms.
-                                send_json(self.sock, format(status=self.status, action="list_rooms", data={"gamename": selected_game_dir.name}, token=self.token))
-                                recv_data = recv_json(self.sock)
+                                recv_data = self.rpc.request(format(status=self.status, action="list_rooms", data={"gamename": selected_game_dir.name}, token=self.token))
                                 act, result, resp_data, self.last_msg = breakdown(recv_data)
                                 if act == "list_rooms" and result == "ok":
                                     rooms = resp_data.get("rooms", [])
@@ -373,8 +388,7 @@ class PLAYER():
                                     room_password = ""
                                     if selected_room['has_password']:
                                         room_password = nb_input("Enter room password: ")
-                                    send_json(self.sock, format(status=self.status, action="join_room", data={"gamename": selected_game_dir.name, "room_id": room_id, "room_password": room_password}, token=self.token))
-                                    recv_data = recv_json(self.sock)
+                                    recv_data = self.rpc.request(format(status=self.status, action="join_room", data={"gamename": selected_game_dir.name, "room_id": room_id, "room_password": room_password}, token=self.token))
                                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                                     if act == "join_room" and result == "ok":
                                         print(f"Joined Room {room_id} successfully! Waiting for game to start...")
@@ -401,8 +415,7 @@ class PLAYER():
                             case _:
                                 print("Invalid input, please try again.")
                 case "3": # logout
-                    send_json(self.sock, format(status=self.status, action="logout", data={}, token=self.token))
-                    recv_data = recv_json(self.sock)
+                    recv_data = self.rpc.request(format(status=self.status, action="logout", data={}, token=self.token))
                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                     if act == "logout" and result == "ok":
                         self.username = None
@@ -419,8 +432,7 @@ class PLAYER():
             print(f"----- Room: {self.room_id} -----")
             print(f"game: {self.game.rsplit('_', 1)[0]}")
 
-            send_json(self.sock, format(status=self.status, action="list_players_in_room", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
-            recv_data = recv_json(self.sock)
+            recv_data = self.rpc.request(format(status=self.status, action="list_players_in_room", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
             act, result, resp_data, self.last_msg = breakdown(recv_data)
             if resp_data.get("room_password", "") != "":
                 print(f"password: {resp_data["room_password"]}")
@@ -434,13 +446,12 @@ class PLAYER():
             print("----------------------")
             print("1. Start Game" if self.host else "1. Ready / not ready")
             print("2. Leave Room")
-            op = nb_input(">> ", self.sock)
+            op = nb_input(">> ", self.rpc)
             os.system('clear')
             match op:
                 case "1": # start game
                     if self.host:
-                        send_json(self.sock, format(status=self.status, action="start_game", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
-                        recv_data = recv_json(self.sock)
+                        recv_data = self.rpc.request(format(status=self.status, action="start_game", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
                         act, result, resp_data, self.last_msg = breakdown(recv_data)
                         if act == "game_start" and result == "ok":
                             os.system("clear")
@@ -454,16 +465,14 @@ class PLAYER():
                         else:
                             print("Failed to start the game. Make sure enough players have joined.")
                     else:
-                        send_json(self.sock, format(status=self.status, action="ready_up", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
-                        recv_data = recv_json(self.sock)
+                        recv_data = self.rpc.request(format(status=self.status, action="ready_up", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
                         act, result, resp_data, self.last_msg = breakdown(recv_data)
                         if act == "ready_up" and result == "ok":
                             print("You are now marked as ready.")
                         else:
                             print("Failed to mark as ready. Try again.")
                 case "2":
-                    send_json(self.sock, format(status=self.status, action="leave_room", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
-                    recv_data = recv_json(self.sock)
+                    recv_data = self.rpc.request(format(status=self.status, action="leave_room", data={"gamename": self.game, "room_id": self.room_id}, token=self.token))
                     act, result, resp_data, self.last_msg = breakdown(recv_data)
                     if act == "leave_room" and result == "ok":
                         self.status = STATUS.LOBBY
@@ -485,7 +494,9 @@ class PLAYER():
                     self.last_msg = "Invalid input, please try again."
 
     def game_page(self):
-        recv_data = recv_json(self.sock)
+        recv_data = self.rpc.next_push()
+        if recv_data is None:
+            raise ConnectionError("lobby connection closed")
         act, result, resp_data, self.last_msg = breakdown(recv_data)
         if act == "game_info":
             host, port = resp_data["gameaddr"]
@@ -520,37 +531,32 @@ def breakdown(resp: dict):
     msg    = resp["msg"]
     return action, result, data, msg
 
-def nb_input(prompt=">> ", conn=None, default=""):
+def nb_input(prompt=">> ", rpc=None, default=""):
     print(prompt, end="", flush=True)
     while True:
-        # check server socket first
-        if conn:
-            r, _, _ = select.select([conn], [], [], 0)
-            if r:
-                try:
-                    resp = recv_json(conn)
-                    act, result, resp_data, last_msg = breakdown(resp)
-                except Exception:
-                    resp = None
-                if resp:
-                    if act == "room_update":
-                        print()
-                        print(f"{last_msg}")
-                        print("Press enter to reflesh")
-                    elif act == "room_closed":
-                        print()
-                        print(f"{last_msg}")
-                        print("Press enter to leave room")
-                        return "closed, goback"
-                    
-                    elif act == "player_ready":
-                        print(f"{last_msg}")
-                        print("Press enter to reflesh")
+        # pushes from the lobby, routed here by the Dispatcher
+        if rpc:
+            resp = rpc.next_push(timeout=0)
+            if resp:
+                act, result, resp_data, last_msg = breakdown(resp)
+                if act == "room_update":
+                    print()
+                    print(f"{last_msg}")
+                    print("Press enter to reflesh")
+                elif act == "room_closed":
+                    print()
+                    print(f"{last_msg}")
+                    print("Press enter to leave room")
+                    return "closed, goback"
+                
+                elif act == "player_ready":
+                    print(f"{last_msg}")
+                    print("Press enter to reflesh")
 
-                    elif act == "game_start":
-                        os.system("clear")
-                        print(f"{last_msg}")
-                        return "game_start"
+                elif act == "game_start":
+                    os.system("clear")
+                    print(f"{last_msg}")
+                    return "game_start"
         # check stdin
         r, _, _ = select.select([sys.stdin], [], [], 0.05)
         if r:
@@ -0,0 +1,53 @@
+import argparse, json, os, shutil
+from NP_hw3.config import PLAYER_JSON, DEVELOPER_JSON, GAME_STORE_JSON
+from NP_hw3.Server.DB_server import UDB, DDB, GSDB
+from NP_hw3.Server.DB_storage import JsonStorage
+
+# Move the DB_server json files to the segmented layout (or re-split them):
+#   python -m NP_hw3.Server.DB_migrate --segments 16 [--data DIR]
+# then start DB_server with the same --segments. Stop DB_server first.
+# A leftover .wal is folded in; the old file / segment directory and log
+# are kept as <name>.bak / <name>.d.bak / <name>.wal.bak.
+DBS = {PLAYER_JSON: UDB, DEVELOPER_JSON: DDB, GAME_STORE_JSON: GSDB}
+
+def current_segments(path: str) -> int:
+    # segments of the layout on disk, 0 for the single file
+    meta = os.path.join(path + ".d", "meta.json")
+    if not os.path.exists(meta):
+        return 0
+    with open(meta, "r", encoding="utf-8") as f:
+        return json.load(f)["segments"]
+
+def migrate(path: str, cls, segments: int):
+    old = current_segments(path)
+    if old == segments:
+        print(f"[*] {path}: already {segments} segments")
+        return
+    # load the old layout (and replay its log) as the server would
+    db = cls(path, segments=old)
+    state = dict(db.read())
+    db.shutdown()
+    # move the old layout and its log (now inside `state`) aside, then
+    # write the new one from scratch
+    src = path + ".d" if old else path
+    for p in (src, db.wal_path):
+        if os.path.exists(p):
+            if os.path.isdir(p + ".bak"):
+                shutil.rmtree(p + ".bak")
+            os.replace(p, p + ".bak")
+    JsonStorage(path, tuple(cls.VOLATILE), segments).save(state, None, 0)
+    print(f"[*] {path}: {len(state)} records, {old or 'single file'} -> {segments or 'single file'}"
+          f" (old copy in {src}.bak)")
+
+def main():
+    ap = argparse.ArgumentParser(description="convert DB_server storage layout")
+    ap.add_argument("--segments", type=int, required=True, help="files per DB, 0 = back to one json file")
+    ap.add_argument("--data", help="directory holding the json files (default: config paths)")
+    args = ap.parse_args()
+    for path, cls in DBS.items():
+        if args.data is not None:
+            path = os.path.join(args.data, os.path.basename(path))
+        migrate(path, cls, args.segments)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import socket, threading, select, time
+from NP_hw3.TCP_tool import send_json, recv_json, set_keepalive, client_hello, has_buffered
+
+# Pooled client for DB_server. DB_server keeps a connection open for many
+# requests (see IDLE_TIMEOUT there), so the Lobby / Developer server can
+# reuse a few sockets and pay one round trip per DB_request instead of
+# connect + hello + request + close.
+
+# answering these twice changes nothing, so they may be resent after the
+# reply was lost; a write may already be applied and is never resent
+READ_ACTIONS = {"read", "query", "find", "page", "stats"}
+
+class DBPool():
+    def __init__(self, host: str, port: int, size: int = 8, connect_timeout: float = 5.0,
+                 max_idle: float = 240.0, request_timeout: float = 30.0):
+        self.addr = (host, port)
+        self.size = size
+        self.connect_timeout = connect_timeout
+        # a DB that doesn't answer within this (acked writes wait up to
+        # DB_server.ACK_TIMEOUT) costs the socket, not the handler thread
+        self.request_timeout = request_timeout
+        # drop sockets idle this long, a bit below DB_server.IDLE_TIMEOUT
+        self.max_idle = max_idle
+        self._idle = []                      # [(sock, last_used)], reused LIFO
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        # metrics
+        self.created = 0
+        self.reconnects = 0                  # stale sockets replaced
+        self.failures = 0                    # requests that raised
+        self.requests = 0
+        self.waits = 0                       # checkouts that had to wait for a slot
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # === public === #
+    def request(self, msg: dict):
+        """Send one request and return DB_server's reply. Raises
+        ConnectionError / OSError like a plain connection would (or
+        whatever decoding the reply raised)."""
+        sock, reused = self._checkout()
+        try:
+            sent = False
+            try:
+                send_json(sock, msg)
+                sent = True
+                resp = recv_json(sock)
+            except (ConnectionError, OSError) as e:
+                self._discard(sock)
+                sock = None
+                if not reused or isinstance(e, TimeoutError):
+                    raise
+                if sent and msg.get("action") not in READ_ACTIONS:
+                    raise  # the DB may have applied it already
+                # the server closed the old socket before reading the
+                # request (idle timeout / restart): try once on a fresh one
+                self.reconnects += 1
+                sock = self._connect()
+                send_json(sock, msg)
+                resp = recv_json(sock)
+        except BaseException:
+            # any failure (a bad reply too) leaves the socket in an unknown
+            # state: drop it, and always give the slot back
+            if sock is not None:
+                self._discard(sock)
+            self.failures += 1
+            self._slots.release()
+            raise
+        self.requests += 1
+        self._checkin(sock)
+        return resp
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = len(self._idle)
+        return {"size": self.size, "idle": idle, "created": self.created,
+                "reconnects": self.reconnects, "failures": self.failures,
+                "requests": self.requests, "waits": self.waits,
+                "wait_total_s": round(self.wait_total, 6), "wait_max_s": round(self.wait_max, 6)}
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            sock.close()
+
+    # === inner === #
+    def _checkout(self):
+        # -> (sock, reused); holds one slot until _checkin / failure
+        if not self._slots.acquire(blocking=False):
+            t0 = time.perf_counter()
+            self._slots.acquire()
+            waited = time.perf_counter() - t0
+            with self._lock:
+                self.waits += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                sock, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.max_idle and self._healthy(sock):
+                return sock, True
+            self.reconnects += 1
+            sock.close()
+        try:
+            return self._connect(), False
+        except OSError:
+            self._slots.release()
+            raise
+
+    def _checkin(self, sock):
+        with self._lock:
+            self._idle.append((sock, time.monotonic()))
+        self._slots.release()
+
+    def _discard(self, sock):
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def _healthy(self, sock) -> bool:
+        # an idle socket must have nothing to read: readable means the
+        # server closed it (EOF) or sent something we never asked for
+        if has_buffered(sock):
+            return False
+        try:
+            r, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not r
+
+    def _connect(self) -> socket.socket:
+        sock = socket.create_connection(self.addr, timeout=self.connect_timeout)
+        sock.settimeout(self.request_timeout)
+        set_keepalive(sock)
+        try:
+            client_hello(sock)  # once per connection, not per request
+        except (ConnectionError, OSError):
+            sock.close()
+            raise
+        with self._lock:
+            self.created += 1
+        return sock
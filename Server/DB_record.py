@@ -0,0 +1,130 @@
+import threading
+
+# Compact in-memory records of the account DBs (UDB / DDB). A plain dict
+# per account costs a hash table per record; these keep the fields in
+# __slots__ and are turned back into the json dict only when a record
+# leaves the DB (a reply, a read() snapshot, a save to disk).
+#
+# Like the dicts they replace, records are never changed in place: an
+# update builds a new one with replace(), so snapshots can share them.
+class Record():
+    __slots__ = ()
+    FIELDS = ()    # json field -> slot, in this order
+    DEFAULTS = {}  # value of a field missing from the json
+
+    @classmethod
+    def from_json(cls, rec: dict):
+        obj = object.__new__(cls)
+        for f in cls.FIELDS:
+            obj._set(f, rec.get(f, cls.DEFAULTS.get(f)))
+        # fields the DB doesn't know (hand edits, older versions) are kept as they are
+        extra = {f: v for f, v in rec.items() if f not in cls.FIELDS}
+        obj.extra = extra or None
+        return obj
+
+    def to_json(self, fields=None, skip=()) -> dict:
+        """The record as json: only `fields` (all if empty), never `skip`."""
+        out = {}
+        for f in self.FIELDS:
+            if (not fields or f in fields) and f not in skip:
+                out[f] = self._get(f)
+        if self.extra:
+            for f, v in self.extra.items():
+                if (not fields or f in fields) and f not in skip:
+                    out[f] = v
+        return out
+
+    def get(self, field, default=None):
+        if field in self.FIELDS:
+            return self._get(field)
+        return (self.extra or {}).get(field, default)
+
+    def replace(self, **changes):
+        # copy-on-write update
+        obj = object.__new__(type(self))
+        for f in self.__slots__:
+            setattr(obj, f, getattr(self, f))
+        for f, v in changes.items():
+            obj._set(f, v)
+        return obj
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_json()!r})"
+
+    # json value <-> slot value; children convert their container fields
+    def _get(self, field):
+        return getattr(self, field)
+
+    def _set(self, field, value):
+        setattr(self, field, value)
+
+# game name <-> bit number of Account.have_play, shared by every account
+_GAME_BITS = {}
+_GAME_NAMES = []
+_games_lock = threading.Lock()
+
+def game_bit(name) -> int:
+    """The have_play bit of a game, numbered on first sight."""
+    bit = _GAME_BITS.get(name)
+    if bit is None:
+        with _games_lock:
+            bit = _GAME_BITS.get(name)
+            if bit is None:
+                bit = _GAME_BITS[name] = len(_GAME_NAMES)
+                _GAME_NAMES.append(name)
+    return 1 << bit
+
+class Account(Record):
+    """UDB record. have_play is a bitmap over the interned game names (an
+    int), so check_play is one bit test; it goes out as the list of names."""
+    __slots__ = ("password", "status", "token", "have_play", "extra")
+    FIELDS = ("password", "status", "token", "have_play")
+    DEFAULTS = {"status": "offline", "token": ""}
+
+    def has_played(self, game) -> bool:
+        try:
+            bit = _GAME_BITS.get(game)
+        except TypeError:
+            return False  # unhashable name, never stored
+        return bit is not None and bool(self.have_play >> bit & 1)
+
+    def _get(self, field):
+        if field == "have_play":
+            names, bits, i = [], self.have_play, 0
+            while bits:
+                if bits & 1:
+                    names.append(_GAME_NAMES[i])
+                bits >>= 1
+                i += 1
+            return names
+        return getattr(self, field)
+
+    def _set(self, field, value):
+        if field == "have_play" and not isinstance(value, int):
+            # a list of names (json); an int is already a bitmap
+            bits = 0
+            for g in value or ():
+                bits |= game_bit(g)
+            value = bits
+        setattr(self, field, value)
+
+class DevAccount(Record):
+    """DDB record; the mailbox is kept as a tuple."""
+    __slots__ = ("password", "status", "token", "download", "mailbox", "extra")
+    FIELDS = ("password", "status", "token", "download", "mailbox")
+    DEFAULTS = {"status": "offline", "token": ""}
+
+    def _get(self, field):
+        if field == "mailbox":
+            return list(self.mailbox)
+        return getattr(self, field)
+
+    def _set(self, field, value):
+        if field == "mailbox":
+            value = tuple(value or ())
+        elif field == "download":
+            value = value or {}
+        setattr(self, field, value)
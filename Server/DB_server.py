@@ -1,330 +1,751 @@
-import uuid ,socket, threading, queue, copy, os, json, tempfile, time  #  For random user IDs and room IDs
+import uuid ,socket, threading, queue, os, json, tempfile, time, argparse, asyncio, bisect, functools, collections  #  For random user IDs and room IDs
 #from loguru import # logger
 from NP_hw3.config import DB_HOST, DB_PORT, LOBBY_HOST, DEV_HOST # addr
 from NP_hw3.config import PLAYER_JSON, DEVELOPER_JSON, ROOM_JSON, GAME_STORE_JSON
-from NP_hw3.TCP_tool import set_keepalive, send_json, recv_json
+from NP_hw3.TCP_tool import set_keepalive, send_json, get_reader, server_hello, instrument, stats_snapshot, install_stats_signal, Preencoded
+from NP_hw3.TCP_async import FramedProtocol
+from NP_hw3.Server.DB_storage import open_storage, ENGINES
+from NP_hw3.Server.DB_record import Record, Account, DevAccount, game_bit
 class DB:
-    def __init__(self, path: str, commit_interval: float = 0.5, max_batch: int = 64):
+    # how far a write must get before its caller is answered: "none" = only
+    # queued (the old behaviour), "applied" = in memory, "durable" = on disk
+    ACK_LEVELS = ("none", "applied", "durable")
+    # what a change costs on disk: "memory" = never written by itself,
+    # "async" = flushed with the next batch, "fsync" = flushed (and its
+    # "durable" ack sent) as soon as the queue is drained, together with
+    # whatever else was queued. Set per collection, overridable per op.
+    DURABILITY = ("memory", "async", "fsync")
+    # fields never written to disk (field -> value after a restart); an
+    # update touching only these and KEY is a "memory" op
+    VOLATILE = {}
+    KEY = None
+    # fields the sqlite engine keeps in indexed columns
+    COLUMNS = ()
+    # in-memory record type (see DB_record), None = the json dict itself
+    RECORD = None
+
+    def __init__(self, path: str, commit_interval: float = 0.5, max_batch: int = 64,
+                 wal: bool = False, snapshot_every: int = 1000, compact_bytes: int = 4 << 20,
+                 durability: str = "async", segments: int = 0, engine: str = "json"):
+        if durability not in self.DURABILITY:
+            raise ValueError(f"unknown durability {durability!r}")
+        if engine == "sqlite" and wal:
+            raise ValueError("the sqlite engine keeps its own journal, no --wal")
         self.path = path
+        self.durability = durability
         self.commit_interval = commit_interval
         self.max_batch = max_batch
+        # WAL mode: every change is appended to <path>.wal as one json line
+        # and fsynced per batch; a background compaction rewrites the full
+        # file and drops the old log once it holds `snapshot_every` records
+        # or `compact_bytes` bytes
+        self.wal = wal
+        self.wal_path = path + ".wal"
+        self.snapshot_every = snapshot_every
+        self.compact_bytes = compact_bytes
+        self.last_compaction = None  # report of the last run, see _compact
+        # where the records are kept on disk (see DB_storage): "json" =
+        # one file, or with `segments` N files of which only those holding
+        # changed keys are rewritten; "sqlite" = one row per record
+        self.segments = segments
+        self.storage = open_storage(engine, path, tuple(self.VOLATILE), segments=segments, columns=self.COLUMNS)
+        # write amplification counters, see stats()
+        self.ops = dict.fromkeys(self.DURABILITY, 0)
+        self.flushes = 0
+        self.bytes_written = 0  # to the WAL, the storage counts its own
 
         self._lock = threading.RLock()
         self._q = queue.Queue()
+        # Committed records are never changed in place (_apply replaces
+        # them), so a shallow copy of _state is a stable snapshot. It is
+        # taken once per version and shared by every read() until the next change.
+        self._version = 0
+        self._snap_version = -1
+        self._snap = {}
+        # fields tuple -> Preencoded view of the snapshot; () is the full one
+        self._views = {}
+        self._seq = 0          # last WAL record number applied
+        self._pending = []     # encoded records not yet written to the log
+        self._log_lock = threading.Lock()  # appends vs. compaction cutting the log
+        self._log_records = 0  # records / bytes in the log file
+        self._log_bytes = 0
+        self._wal_leftover = False  # a log exists from an earlier run
+        self._dirty = set()    # keys changed since the last incremental save, None = all
         self._state = self._load_file() 
+        if self._dirty is None:
+            # first start on this storage layout, or the log replayed
+            # something we can't place
+            self.storage.save(self._state, None, self._seq)
+            self._dirty = set()
+        self._loaded()
 
         self._stop_evt = threading.Event()
         self._writer = threading.Thread(target=self._writer_loop, daemon=True)
         self._writer.start()
+        self._compact_evt = threading.Event()
+        if self.wal:
+            threading.Thread(target=self._compactor_loop, daemon=True).start()
+            self._maybe_compact()  # a long log left by the last run
         # print(f"[*] DB initialized from {self.path}")
 
     #===================== Socket API ==============================#
     def create(self, new_data: dict):
-        self._q.put(("create", new_data))
+        self.write("create", new_data)
 
-    def read(self) -> dict:
-        with self._lock:
-            return copy.deepcopy(self._state)
+    def read(self, fields: list = None) -> dict:
+        # shared snapshot: callers must not modify it
+        return self._view(fields).obj
+
+    def read_encoded(self, fields: list = None) -> Preencoded:
+        # read() encoded once per version instead of once per request
+        return self._view(fields)
 
     def update(self, new_data: dict):
-        self._q.put(("update", new_data))
+        self.write("update", new_data)
     
     def delete(self, remove_data: dict):
-        self._q.put(("delete", remove_data))
-
-    def query(self) -> dict:
+        self.write("delete", remove_data)
+
+    def batch(self, ops: list):
+        # [(op, args)] applied back to back under one lock, never split by a flush
+        self.write("__batch__", ops)
+
+    def write(self, op: str, args, ack: str = "none", callback=None, durability: str = None):
+        """Queue a create / update / delete (or "__batch__" of [(op, args)]
+        / [(op, args, durability)]). With ack "applied" or "durable",
+        callback(result) runs on the writer thread once the op is in memory
+        / on disk; result says whether it changed anything (a list for a
+        batch), False if the flush failed. durability overrides the
+        collection's level for this op (see DURABILITY)."""
+        if op == "__batch__":
+            items = [(item[0], item[1], item[2] if len(item) > 2 and item[2] else durability) for item in args]
+        else:
+            items = [(op, args, durability)]
+        waiter = None if ack == "none" or callback is None else (ack, callback)
+        self._q.put((items, op == "__batch__", waiter))
+
+    def query(self, data: dict, fields: list = None) -> dict:
         #  Do nothing in parent but children class.
         return
+
+    def find(self, data: dict, fields: list = None) -> dict:
+        #  Lookup by secondary index, children class only.
+        return {}
+
+    def page(self, data: dict, fields: list = None) -> dict:
+        #  Ordered paging, children class only.
+        return {}
+    def stats(self) -> dict:
+        st = self.storage.stats()
+        return {"records": len(self._state), "seq": self._seq, "wal": self.wal,
+                "durability": self.durability, "engine": st["engine"], "segments": self.segments,
+                "ops": dict(self.ops), "flushes": self.flushes, "files_written": st["files_written"],
+                "bytes_written": self.bytes_written + st["bytes_written"],
+                "log_records": self._log_records, "log_bytes": self._log_bytes,
+                "last_compaction": self.last_compaction}
+
     def shutdown(self):
-        self._q.put(("__stop__", None))
-        self._stop_evt.wait(timeout=3.0)
+        self._q.put(("__stop__", False, None))
+        if self._stop_evt.wait(timeout=3.0):
+            self.storage.close()
     
     #==================== Inner declaration for function ===========#
     def _load_file(self) -> dict:
-        if not os.path.exists(self.path):
-            with open(self.path, "w", encoding="utf-8") as f:
-                json.dump({}, f)
-            return {}
+        data = self.storage.load()
+        self._seq = self.storage.seq
+        if self.storage.fresh:
+            # read from another layout: write all of it into this one
+            self._dirty = None
+        if self.VOLATILE:
+            # not on disk; presence from the last run is stale anyway
+            data = {k: dict(rec, **self.VOLATILE) if isinstance(rec, dict) else rec
+                    for k, rec in data.items()}
+        if self.RECORD is not None:
+            data = {k: self.RECORD.from_json(rec) if isinstance(rec, dict) else rec
+                    for k, rec in data.items()}
+        # replayed even with wal off, so switching modes loses nothing
+        self._state = data
+        self._replay()
+        return data
+
+    def _replay(self):
+        # apply the log records newer than the snapshot; a torn last line
+        # (crash in the middle of an append) is cut off
+        if not os.path.exists(self.wal_path):
+            return
+        self._wal_leftover = True
+        good = 0
+        with open(self.wal_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                good += len(line)
+                self._log_records += 1
+                args = rec["args"]
+                if self.VOLATILE and isinstance(args, dict):
+                    # logs from before VOLATILE may still carry presence
+                    args = {f: v for f, v in args.items() if f not in self.VOLATILE}
+                if rec["seq"] <= self.storage.seq_of(self._safe_keys(rec["op"], args)):
+                    continue  # already in the stored copy
+                if self.storage.incremental:
+                    self._mark_dirty(rec["op"], args)
+                try:
+                    self._apply(rec["op"], args)
+                except (KeyError, TypeError, AttributeError):
+                    pass  # failed the same way when it was first applied
+                self._seq = max(self._seq, rec["seq"])
+        self._log_bytes = good
+        if good != os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(good)
+
+    def _apply(self, op: str, args: dict) -> bool:
+        # change self._state for one create/update/delete (lock held);
+        # True if something changed. Done by children class.
+        return False
+
+    def _keys_of(self, op: str, args: dict):
+        # the keys one create/update/delete touches (lock held), None if unknown
+        if self.KEY is not None and isinstance(args, dict) and self.KEY in args:
+            return [args[self.KEY]]
+        return None
+
+    # --- changed keys, for incremental storage --- #
+    def _safe_keys(self, op: str, args: dict):
         try:
-            with open(self.path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    return {}
-                return data
-        except (json.JSONDecodeError, OSError):
-            return {}
-    def _writer_loop(self):
-        #  Do nothing in parent but children class.
-        return
-    def _atomic_write(self, data: dict):
-        """write into tempfile → flush+fsync → os.replace (atomic)"""
-        dir_ = os.path.dirname(self.path) or "."
-        fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=dir_, text=True)
+            return self._keys_of(op, args)
+        except (KeyError, TypeError, AttributeError):
+            return None  # odd record: treat every key as touched
+
+    def _mark_dirty(self, op: str, args: dict):
+        keys = self._safe_keys(op, args)
+        if keys is None or self._dirty is None:
+            self._dirty = None
+        else:
+            self._dirty.update(keys)
+
+    def _take_dirty(self):
+        # keys to write now (lock held); put back with _restore_dirty if that fails
+        keys, self._dirty = self._dirty, set()
+        return keys
+
+    def _restore_dirty(self, keys):
+        with self._lock:
+            if keys is None or self._dirty is None:
+                self._dirty = None
+            else:
+                self._dirty |= keys
+
+    def _save(self, snap: dict, keys, seq: int):
         try:
-            with os.fdopen(fd, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-                f.flush()
-                os.fsync(f.fileno())
-            os.replace(tmp, self.path)
-        finally:
-            try:
-                os.remove(tmp)
-            except FileNotFoundError:
-                pass
-#==================== Inner logic for different DB==============================#
-class UDB(DB):
-    def query(self, data):
+            self.storage.save(snap, keys, seq)
+        except OSError:
+            if self.storage.incremental:
+                self._restore_dirty(keys)
+            raise
+
+    def _loaded(self):
+        # state is loaded and replayed (build derived structures here)
+        return
+
+    def _snapshot(self) -> dict:
+        # the in-memory records at this version (lock held), still compact
+        if self._snap_version != self._version:
+            self._snap_version = self._version
+            self._snap = dict(self._state)
+            self._views = {}
+        return self._snap
+
+    def _view(self, fields) -> Preencoded:
         with self._lock:
-            userlist = self._state  # 直接使用 _state 而非 read()
-            if data["username"] in userlist:
-                return copy.deepcopy(userlist[data["username"]])
-            return {}
+            snap = self._snapshot()
+            views = self._views
+        key = tuple(fields or ())
+        view = views.get(key)
+        if view is None:
+            # json view, built once per version and field list
+            if self.RECORD is None and not key:
+                view = Preencoded(snap)
+            else:
+                view = Preencoded({k: _project(rec, fields) for k, rec in snap.items()})
+            views[key] = view
+        return view
 
     def _writer_loop(self):
         dirty = False
+        urgent = False  # an "fsync" op is waiting: flush once the queue is empty
         batch = 0
+        durable = []  # [(callback, result)] answered after the next flush
         last_flush = time.time()
         while True:
-            timeout = max(0.0, self.commit_interval - (time.time() - last_flush))
+            if durable or urgent:
+                # group commit: drain what is queued, then one flush for all waiters
+                timeout = 0
+            else:
+                timeout = max(0.0, self.commit_interval - (time.time() - last_flush))
             try:
-                op, args = self._q.get(timeout=timeout)
+                items, is_batch, waiter = self._q.get(timeout=timeout)
             except queue.Empty:
-                op = None
-            if op == "__stop__":
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
+                items = None
+            if items == "__stop__":
+                self._commit(dirty, durable)
                 self._stop_evt.set()
                 return
 
-            if op == "create":
-                with self._lock:
-                    new_account = {
-                        "password": args["password"],
-                        "status": "offline",
-                        "token": "",
-                        "have_play": []
-                    }
-                    self._state[args["username"]] = new_account
-                    dirty = True
-                    batch += 1
-
-            if op == "update":
-                with self._lock:
-                    if args["username"] in self._state:
-                        self._state[args["username"]]["status"] = args.get("status", self._state[args["username"]]["status"])
-                        self._state[args["username"]]["token"] = args.get("token", self._state[args["username"]]["token"])
-                        p = args.get("play", None)
-                        if p != None and p not in self._state[args["username"]]["have_play"]:
-                            self._state[args["username"]]["have_play"].append(p)
-                        dirty = True
-                        batch += 1
-
-            if op == "delete":
+            if items is not None:
+                results = []
                 with self._lock:
-                    if args["username"] in self._state:
-                        del self._state[args["username"]]
-                        dirty = True
-                        batch += 1
-
-            if op is None:
-                # no request -> if dirty -> update
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
-                    dirty = False
-                    batch = 0
-                    last_flush = time.time()
+                    for op, args, level in items:
+                        level = self._durability_of(op, args, level)
+                        try:
+                            changed = self._apply(op, args)
+                        except (KeyError, TypeError, AttributeError) as e:
+                            print(f"[!] {os.path.basename(self.path)}: {op} failed: {e!r}")
+                            changed = False
+                        if changed:
+                            self._version += 1
+                            self.ops[level] += 1
+                            if level != "memory":
+                                dirty = True
+                                urgent = urgent or level == "fsync"
+                                batch += 1
+                                if self.storage.incremental:
+                                    self._mark_dirty(op, args)
+                                if self.wal:
+                                    self._log(op, args)
+                        results.append(changed)
+                if waiter is not None:
+                    ack, callback = waiter
+                    result = results if is_batch else results[0]
+                    if ack == "durable" and dirty:
+                        durable.append((callback, result))
+                    else:
+                        # "applied", or nothing changed so nothing to write
+                        self._ack(callback, result)
+                if batch < self.max_batch:
+                    continue
+            elif not dirty:
+                # idle: wait a whole interval again instead of spinning on get(timeout=0)
+                last_flush = time.time()
                 continue
 
-            if batch >= self.max_batch:
-                with self._lock:
-                    self._atomic_write(self._state)
-                dirty = False
-                batch = 0
-                last_flush = time.time()
+            # no request for a while, batch full or someone waits for the disk -> update
+            dirty = not self._commit(dirty, durable)
+            urgent = False
+            batch = 0
+            last_flush = time.time()
 
-class DDB(DB):
-    def query(self, data):
+    def _commit(self, dirty: bool, durable: list) -> bool:
+        # flush if needed, then answer the "durable" waiters; False if the flush failed
+        ok = True
+        if dirty:
+            try:
+                self._flush()
+            except OSError as e:
+                print(f"[!] {os.path.basename(self.path)}: flush failed: {e!r}")
+                ok = False
+        for callback, result in durable:
+            self._ack(callback, result if ok else False)
+        durable.clear()
+        return ok
+
+    def _ack(self, callback, result):
+        try:
+            callback(result)
+        except Exception as e:
+            print(f"[!] {os.path.basename(self.path)}: ack callback failed: {e!r}")
+
+    def _durability_of(self, op: str, args, level: str) -> str:
+        if level in self.DURABILITY:
+            return level
+        if (op == "update" and self.VOLATILE and isinstance(args, dict)
+                and all(f == self.KEY or f in self.VOLATILE for f in args)):
+            return "memory"  # presence churn only
+        return self.durability
+
+    def _log(self, op: str, args: dict):
+        # encode now, `args` may be shared with _state and change later
+        if self.VOLATILE and isinstance(args, dict):
+            args = {f: v for f, v in args.items() if f not in self.VOLATILE}
+        self._seq += 1
+        rec = {"seq": self._seq, "op": op, "args": args}
+        self._pending.append(json.dumps(rec, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def _flush(self):
+        self.flushes += 1
+        if not self.wal:
+            # serialize a snapshot, readers and the writer don't wait for the fsync
+            with self._lock:
+                snap = self._snapshot()
+                keys = self._take_dirty() if self.storage.incremental else None
+            self._save(snap, keys, self._seq)
+            if self._wal_leftover:
+                # the full file now holds what the old log had
+                os.remove(self.wal_path)
+                self._wal_leftover = False
+                self._seq = 0  # no log to line up with any more: files carry no seq tag
+            return
         with self._lock:
-            userlist = self._state  # 直接使用 _state 而非 read()
-            if data["username"] in userlist:
-                return copy.deepcopy(userlist[data["username"]])
-            return {}
+            records, self._pending = self._pending, []
+        data = b"".join(records)
+        with self._log_lock:
+            with open(self.wal_path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_records += len(records)
+            self._log_bytes += len(data)
+            self.bytes_written += len(data)
+        self._maybe_compact()
 
-    def _writer_loop(self):
-        dirty = False
-        batch = 0
-        last_flush = time.time()
+    def _maybe_compact(self):
+        if self._log_records >= self.snapshot_every or self._log_bytes >= self.compact_bytes:
+            self._compact_evt.set()
+
+    def _compactor_loop(self):
         while True:
-            timeout = max(0.0, self.commit_interval - (time.time() - last_flush))
+            self._compact_evt.wait()
+            self._compact_evt.clear()
+            if self._log_records < self.snapshot_every and self._log_bytes < self.compact_bytes:
+                continue  # set again while the last run was going
             try:
-                op, args = self._q.get(timeout=timeout)
-            except queue.Empty:
-                op = None
-            if op == "__stop__":
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
-                self._stop_evt.set()
-                return
+                self._compact()
+            except OSError as e:
+                print(f"[!] {os.path.basename(self.path)}: compaction failed: {e!r}")
+
+    def _compact(self):
+        """Snapshot + log cut, off the writer thread. Only the point-in-time
+        copy holds _lock; serializing and fsyncing the snapshot don't."""
+        t0 = time.perf_counter()
+        with self._lock:
+            with self._log_lock:
+                # every record before `cut` in the log is already in this copy
+                # (records are applied before they are written)
+                snap = self._snapshot()
+                seq = self._seq
+                cut, cut_records = self._log_bytes, self._log_records
+                # incremental storage: only what changed since the last compaction
+                keys = self._take_dirty() if self.storage.incremental else None
+        t1 = time.perf_counter()
+        self._save(snap, keys, seq)
+        t2 = time.perf_counter()
+        with self._log_lock:
+            # keep the tail written since the copy; replay skips records <= seq
+            dir_ = os.path.dirname(self.wal_path) or "."
+            fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=dir_)
+            try:
+                with open(self.wal_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                    src.seek(cut)
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp, self.wal_path)
+            finally:
+                try:
+                    os.remove(tmp)
+                except FileNotFoundError:
+                    pass
+            self._log_records -= cut_records
+            self._log_bytes -= cut
+        t3 = time.perf_counter()
+        self.last_compaction = {"time": time.time(), "seq": seq, "records": cut_records, "log_bytes": cut,
+                                "copy_ms": round((t1 - t0) * 1e3, 3), "write_ms": round((t2 - t1) * 1e3, 3),
+                                "total_ms": round((t3 - t0) * 1e3, 3)}
+        print(f"[*] {os.path.basename(self.path)} compacted {cut_records} records ({cut} bytes) "
+              f"in {self.last_compaction['total_ms']} ms (lock held {self.last_compaction['copy_ms']} ms)")
 
-            if op == "create":
-                with self._lock:
-                    new_account = {
-                        "password": args["password"],
-                        "status": "offline",
-                        "token": "",
-                        "download": {},
-                        "mailbox": []
-                    }
-                    self._state[args["username"]] = new_account
-                    dirty = True
-                    batch += 1
-
-            if op == "update":
-                # TODO for download
-                with self._lock:
-                    if args["username"] in self._state:
-                        self._state[args["username"]]["status"] = args.get("status", self._state[args["username"]]["status"])
-                        self._state[args["username"]]["token"] = args.get("token", self._state[args["username"]]["token"])
-                        if args.get("inv_msg", []) != "clear" and args.get("inv_msg", []) != []: # get inv msg
-                                self._state[args["username"]]["mailbox"].extend([args.get("inv_msg", [])])
-                        elif args.get("inv_msg", []) == "clear":
-                            self._state[args["username"]]["mailbox"] = []
-                        dirty = True
-                        batch += 1
-
-            if op == "delete":
-                with self._lock:
-                    if args["username"] in self._state:
-                        del self._state[args["username"]]
-                        dirty = True
-                        batch += 1
-
-            if op is None:
-                # no request -> if dirty -> update
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
-                    dirty = False
-                    batch = 0
-                    last_flush = time.time()
-                continue
+#==================== Inner logic for different DB==============================#
+class UDB(DB):
+    # presence, rebuilt by logins: never written to disk
+    VOLATILE = {"status": "offline", "token": ""}
+    KEY = "username"
+    RECORD = Account
 
-            if batch >= self.max_batch:
-                with self._lock:
-                    self._atomic_write(self._state)
-                dirty = False
-                batch = 0
-                last_flush = time.time()
+    def query(self, data, fields=None):
+        with self._lock:
+            userlist = self._state  # 直接使用 _state 而非 read()
+            rec = userlist.get(data["username"])
+            if "play" in data:
+                # check_play: answered here with one set lookup
+                return {"played": rec is not None and rec.has_played(data["play"])}
+            return _project(rec, fields) if rec is not None else {}
+
+    def _apply(self, op, args) -> bool:
+        if op == "create":
+            new_account = Account.from_json({
+                "password": args["password"],
+                "status": "offline",
+                "token": "",
+                "have_play": []
+            })
+            if args["username"] in self._state:
+                return False  # taken meanwhile (register is query + create)
+            self._state[args["username"]] = new_account
+            return True
+
+        if op == "update":
+            if args["username"] in self._state:
+                rec = self._state[args["username"]]
+                changes = {"status": args.get("status", rec.status), "token": args.get("token", rec.token)}
+                p = args.get("play", None)
+                if p != None and not rec.has_played(p):
+                    changes["have_play"] = rec.have_play | game_bit(p)
+                self._state[args["username"]] = rec.replace(**changes)  # copy-on-write
+                return True
+
+        if op == "delete":
+            if args["username"] in self._state:
+                del self._state[args["username"]]
+                return True
+        return False
+
+class DDB(DB):
+    # presence, rebuilt by logins: never written to disk
+    VOLATILE = {"status": "offline", "token": ""}
+    KEY = "username"
+    RECORD = DevAccount
+
+    def query(self, data, fields=None):
+        with self._lock:
+            userlist = self._state  # 直接使用 _state 而非 read()
+            rec = userlist.get(data["username"])
+            return _project(rec, fields) if rec is not None else {}
+
+    def _apply(self, op, args) -> bool:
+        if op == "create":
+            new_account = DevAccount.from_json({
+                "password": args["password"],
+                "status": "offline",
+                "token": "",
+                "download": {},
+                "mailbox": []
+            })
+            if args["username"] in self._state:
+                return False  # taken meanwhile (register is query + create)
+            self._state[args["username"]] = new_account
+            return True
+
+        if op == "update":
+            # TODO for download
+            if args["username"] in self._state:
+                rec = self._state[args["username"]]
+                changes = {"status": args.get("status", rec.status), "token": args.get("token", rec.token)}
+                if args.get("inv_msg", []) != "clear" and args.get("inv_msg", []) != []: # get inv msg
+                        changes["mailbox"] = rec.mailbox + (args.get("inv_msg", []),)
+                elif args.get("inv_msg", []) == "clear":
+                    changes["mailbox"] = ()
+                self._state[args["username"]] = rec.replace(**changes)  # copy-on-write
+                return True
+
+        if op == "delete":
+            if args["username"] in self._state:
+                del self._state[args["username"]]
+                return True
+        return False
 
 class GSDB(DB):
-    def query(self, data):
+    # secondary indexes: field -> value -> set of game keys
+    INDEXED = ("author", "game_type", "max_players")
+    COLUMNS = INDEXED
+    _idx = None  # built by _loaded(), replayed records skip it
+    # page() orders: name -> (sort value of a record, newest / biggest first)
+    # popularity is the number of comments, the only usage count the store keeps
+    ORDERS = {
+        "last_update": (lambda rec: str(rec.get("last_update", "")), True),
+        "name": (lambda rec: str(rec.get("gamename", "")), False),
+        "popularity": (lambda rec: len(rec.get("comments") or ()), True),
+    }
+    MAX_PAGE = 100
+    _sorted = None
+    _sorted_version = -1
+
+    def query(self, data, fields=None):
         with self._lock:
             gamelist = self._state  # 直接使用 _state 而非 read()
             # logger.info(f"GSDB query with data: {data}")
+            if "key" in data:
+                # by store key ("<gamename>_<author>")
+                return _project(gamelist.get(data["key"], {}), fields)
             if data["gamename"] is None:
                 # return all games from a developer
-                result = {}
-                # logger.info(f"{gamelist}")
-                for gname, gconfig in gamelist.items():
-                    if gconfig["author"] == data["username"]:
-                        result[gname] = copy.deepcopy(gconfig)
-                # logger.info(f"GSDB query result: {result}")
-                return result
+                return self._find({"author": data["username"]}, fields)
             
-            if data["gamename"]+"_"+data["username"] in gamelist:
-                return copy.deepcopy(gamelist[data["gamename"]+"_"+data["username"]])
-            return {}
-
-    def _writer_loop(self):
-        dirty = False
-        batch = 0
-        last_flush = time.time()
-        while True:
-            timeout = max(0.0, self.commit_interval - (time.time() - last_flush))
-            try:
-                op, args = self._q.get(timeout=timeout)
-            except queue.Empty:
-                op = None
-            if op == "__stop__":
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
-                self._stop_evt.set()
-                return
+            return _project(gamelist.get(data["gamename"]+"_"+data["username"], {}), fields)
 
-            if op == "create":
-                with self._lock:
-                    self._state[args["gamename"]+"_"+args["username"]] = args["config"]
-                    dirty = True
-                    batch += 1
-
-            if op == "update":
-                with self._lock:
-
-                    if args.get("config", {}) != {} and args["gamename"]+"_"+args["username"] in self._state:
-                        args["config"]["comments"] = self._state[args["gamename"]+"_"+args["username"]]["comments"]
-                        self._state[args["gamename"]+"_"+args["username"]] = args["config"]
-                    else:
-                        self._state[args["gamename"]]["comments"].append(args["new_comment"]) 
-                    dirty = True
-                    batch += 1
-
-
-            if op == "delete":
-                with self._lock:
-                    if args["gamename"] in self._state:
-                        del self._state[args["gamename"]]
-                        dirty = True
-                        batch += 1
-
-            if op is None:
-                # no request -> if dirty -> update
-                if dirty:
-                    with self._lock:
-                        self._atomic_write(self._state)
-                    dirty = False
-                    batch = 0
-                    last_flush = time.time()
+    def find(self, data: dict, fields: list = None) -> dict:
+        """Games whose fields equal every value in `data`, e.g.
+        {"author": "Tsai", "game_type": "GUI"}. Indexed fields narrow the
+        candidates first, so the cost follows the result size."""
+        with self._lock:
+            return self._find(data, fields)
+
+    def _find(self, data: dict, fields: list = None) -> dict:
+        sets = [self._idx[f].get(_ikey(v), ()) for f, v in data.items() if f in self._idx]
+        if sets:
+            keys = min(sets, key=len)
+        else:
+            keys = self._state.keys()
+        result = {}
+        for key in keys:
+            rec = self._state[key]
+            if all(rec.get(f) == v for f, v in data.items()):
+                result[key] = _project(rec, fields)
+        return result
+
+    def page(self, data: dict, fields: list = None) -> dict:
+        """One page of the catalog: {"order": "last_update", "limit": 20,
+        "cursor": None}. Returns {"games": {key: record} in order, "next":
+        cursor of the following page or None}. The cursor is the (sort value,
+        key) of the last game sent, so games added meanwhile never shift or
+        repeat the rest of the listing."""
+        order = data.get("order") or "last_update"
+        if order not in self.ORDERS:
+            raise ValueError(f"unknown order {order!r}")
+        limit = max(1, min(int(data.get("limit") or 20), self.MAX_PAGE))
+        cursor = data.get("cursor")
+        if cursor is not None:
+            cursor = tuple(json.loads(cursor))
+        _, desc = self.ORDERS[order]
+        with self._lock:
+            entries = self._sorted_entries(order)
+            if cursor is None:
+                start = len(entries) if desc else 0
+            elif desc:
+                start = bisect.bisect_left(entries, cursor)
+            else:
+                start = bisect.bisect_right(entries, cursor)
+            if desc:
+                chunk = entries[max(0, start - limit):start][::-1]
+                more = start - limit > 0
+            else:
+                chunk = entries[start:start + limit]
+                more = start + limit < len(entries)
+            games = {key: _project(self._state[key], fields) for _, key in chunk}
+        nxt = json.dumps(list(chunk[-1])) if chunk and more else None
+        return {"games": games, "next": nxt}
+
+    def _sorted_entries(self, order: str) -> list:
+        # [(sort value, key)] ascending, rebuilt lazily once per version
+        if self._sorted_version != self._version:
+            self._sorted = {}
+            self._sorted_version = self._version
+        entries = self._sorted.get(order)
+        if entries is None:
+            value, _ = self.ORDERS[order]
+            entries = self._sorted[order] = sorted((value(rec), key) for key, rec in self._state.items())
+        return entries
+
+    def _loaded(self):
+        self._idx = {f: {} for f in self.INDEXED}
+        for key, rec in self._state.items():
+            self._index(key, rec, add=True)
+
+    def _index(self, key: str, rec: dict, add: bool):
+        if self._idx is None or not isinstance(rec, dict):
+            return
+        for f in self.INDEXED:
+            if f not in rec:
                 continue
+            v = _ikey(rec[f])
+            if add:
+                self._idx[f].setdefault(v, set()).add(key)
+            else:
+                keys = self._idx[f].get(v)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._idx[f][v]
+
+    def _put(self, key: str, rec: dict):
+        # replace a record and keep the indexes in step
+        old = self._state.get(key)
+        if old is not None:
+            self._index(key, old, add=False)
+        self._state[key] = rec
+        self._index(key, rec, add=True)
+
+    def _keys_of(self, op, args):
+        # same key choice as _apply
+        if op == "create":
+            return [args["gamename"]+"_"+args["username"]]
+        if op == "update" and args.get("config", {}) != {} and args["gamename"]+"_"+args.get("username", "") in self._state:
+            return [args["gamename"]+"_"+args["username"]]
+        return [args["gamename"]]
+
+    def _apply(self, op, args) -> bool:
+        if op == "create":
+            self._put(args["gamename"]+"_"+args["username"], args["config"])
+            return True
+
+        if op == "update":
+            # copy-on-write: build new records, the old ones may be in a snapshot
+            if args.get("config", {}) != {} and args["gamename"]+"_"+args["username"] in self._state:
+                old = self._state[args["gamename"]+"_"+args["username"]]
+                self._put(args["gamename"]+"_"+args["username"], dict(args["config"], comments=old["comments"]))
+            else:
+                old = self._state[args["gamename"]]
+                # only comments change, indexed fields stay the same
+                self._state[args["gamename"]] = dict(old, comments=old["comments"] + [args["new_comment"]])
+            return True
+
+        if op == "delete":
+            if args["gamename"] in self._state:
+                self._index(args["gamename"], self._state.pop(args["gamename"]), add=False)
+                return True
+        return False
+
+def _project(rec, fields):
+    # only the requested fields of a record (all of them if fields is empty)
+    if isinstance(rec, Record):
+        return rec.to_json(fields)
+    if not fields or not isinstance(rec, dict):
+        return rec
+    return {f: rec[f] for f in fields if f in rec}
+
+def _ikey(v):
+    # index key: unhashable values (lists from odd configs) as json
+    try:
+        hash(v)
+        return v
+    except TypeError:
+        return json.dumps(v, sort_keys=True)
 
-            if batch >= self.max_batch:
-                with self._lock:
-                    self._atomic_write(self._state)
-                dirty = False
-                batch = 0
-                last_flush = time.time()
+# a persistent client (Lobby / Developer server) that sends nothing for
+# this long gets its connection closed; it reconnects on the next request
+IDLE_TIMEOUT = 300.0
+# peers allowed to talk to the DB (main() --allow adds more)
+ALLOWED_HOSTS = {LOBBY_HOST, DEV_HOST}
 
 def DB_handle_requset(conn: socket.socket, addr):
     set_keepalive(conn)
-    if addr[0] != LOBBY_HOST and addr[0] != DEV_HOST:
+    if addr[0] not in ALLOWED_HOSTS:
         # logger.info("Invalid Accessing from other host : ", addr)
         send_json(conn, {})
         conn.close()
         return
     try:
-        #  receive request
-        req = recv_json(conn)
-        Database = DB_DICT[req["type"]]
-        resp = {}
-        # logger.info(f"Request from {addr}: {req}")
-        match req["action"]:
-            case "create":
-                Database.create(req["data"])
-            case "read":
-                resp = Database.read()
-            case "update":
-                Database.update(req["data"])
-            case "delete":
-                Database.delete(req["data"])
-            case "query":
-                resp = Database.query(req["data"])
-            case _:
-                # logger.info(f"DB_handle_request: unknown action {req['action']}")
-                resp = {} #  design a ERROR response
-        send_json(conn, resp)
+        instrument(conn, f"db {addr[0]}:{addr[1]}")  # no-op unless NP_TCP_STATS is set
+        conn.settimeout(IDLE_TIMEOUT)
+        reader = get_reader(conn)
+        # serve requests until the client closes: old clients send one and
+        # hang up, newer ones keep the connection for many requests
+        while True:
+            try:
+                req = reader.recv_json()
+            except socket.timeout:
+                # print(f"[*] {addr} idle, closing")
+                break
+            except ConnectionError:
+                # peer closed between requests, the normal end
+                break
+            if server_hello(conn, req):
+                # codec negotiated, the real request follows
+                continue
+            send_json(conn, DB_dispatch(req))
     except (ConnectionError, OSError) as e:
         print(f"[!] {addr} disconnected: {e}")
         # logger.info(f"[!] {addr} disconnected: {e}")
@@ -334,26 +755,205 @@ def DB_handle_requset(conn: socket.socket, addr):
         conn.close()
         # logger.info(f"[*] closed {addr}")
 
+# how long a thread waits for an acknowledged write
+ACK_TIMEOUT = 10.0
+# DB_dispatch result when the reply goes to on_ack later
+PENDING = object()
+
+def DB_dispatch(req: dict, on_ack=None):
+    """Answer one request. Writes with "ack": "applied" / "durable" reply
+    {"ok": bool} once acknowledged: the calling thread waits for it, or,
+    if on_ack is given (event loop), PENDING is returned and on_ack(reply)
+    is called from the writer thread later."""
+    if req.get("action") == "stats":
+        # admin: traffic counters + storage (peer already checked by the handler)
+        return dict(stats_snapshot(), dbs={name: db.stats() for name, db in DB_DICT.items()})
+    if req.get("action") == "batch":
+        return DB_batch(req.get("ops") or [], req.get("ack"), on_ack, req.get("durability"))
+    Database = DB_DICT.get(req.get("type"))
+    if Database is None:
+        return {}
+    resp = {}
+    # optional projection, applied before encoding: ["gamename", "version", ...]
+    fields = req.get("fields")
+    # logger.info(f"Request: {req}")
+    match req["action"]:
+        case "create" | "update" | "delete":
+            resp = _acked([(Database, req["action"], req["data"])], req.get("ack"), on_ack,
+                          lambda results: {} if results is None else {"ok": bool(results[0])},
+                          req.get("durability"))
+        case "read":
+            # same bytes for every reader until the next write
+            resp = Database.read_encoded(fields)
+        case "query":
+            resp = Database.query(req["data"], fields)
+        case "find":
+            resp = Database.find(req["data"], fields)
+        case "page":
+            try:
+                resp = Database.page(req["data"], fields)
+            except (ValueError, TypeError, AttributeError):
+                resp = {}  # bad order / cursor
+        case _:
+            # logger.info(f"DB_handle_request: unknown action {req['action']}")
+            resp = {} #  design a ERROR response
+    return resp
+
+def DB_batch(ops: list, ack: str = None, on_ack=None, durability: str = None) -> list:
+    """Several requests in one round trip: [{"type", "action", "data"}, ...]
+    -> one result per op, in order. The writes for each DB reach its writer
+    as a single queue item, so they are applied together and never split
+    across flushes. A read placed after a write sees it: the batch is cut
+    there, and the writes before the cut are applied (acknowledged as
+    "applied", or "durable" if that was asked) before the reads run.
+    With ack, every write's result is {"ok": bool}. An op's own "durability"
+    wins over the batch's."""
+    # [(writes, reads)]: writes = {DB: ([(op, args, durability)], [index])},
+    # reads = [(index, op)] run once those writes are applied
+    steps = [({}, [])]
+    for i, op in enumerate(ops):
+        Database = DB_DICT.get(op.get("type")) if isinstance(op, dict) else None
+        if Database is not None and op.get("action") in ("create", "update", "delete"):
+            if steps[-1][1]:
+                # a write after reads: those reads must not wait for it
+                steps.append(({}, []))
+            items, slots = steps[-1][0].setdefault(Database, ([], []))
+            items.append((op["action"], op["data"], op.get("durability")))
+            slots.append(i)
+        else:
+            steps[-1][1].append((i, op))
+    results = [{} for _ in ops]
+    return _batch_step(steps, 0, results, ack, on_ack, durability)
+
+def _batch_step(steps: list, k: int, results: list, ack: str, on_ack, durability: str):
+    # queue the writes of step k, then (once acknowledged if anything reads
+    # after them) fill in its reads and go on with step k + 1
+    writes, reads = steps[k]
+    last = k == len(steps) - 1
+    level = ack
+    if writes and (reads or not last):
+        level = "durable" if ack == "durable" else "applied"
+
+    def build(acked):
+        if ack in DB.ACK_LEVELS[1:]:
+            for (items, slots), changed in zip(writes.values(), acked or ()):
+                for i, ok in zip(slots, changed or [False] * len(slots)):
+                    results[i] = {"ok": ok}
+        for i, op in reads:
+            results[i] = _batch_read(op)
+        if last:
+            return results
+        return _batch_step(steps, k + 1, results, ack, on_ack, durability)
+
+    # a later step answers on_ack itself; PENDING from it means "not yet"
+    chained = None if on_ack is None else (lambda resp: resp is PENDING or on_ack(resp))
+    return _acked([(Database, "__batch__", items) for Database, (items, _) in writes.items()],
+                  level, chained, build, durability)
+
+def _batch_read(op):
+    Database = DB_DICT.get(op.get("type")) if isinstance(op, dict) else None
+    if Database is None:
+        return {}
+    if op.get("action") == "read":
+        # plain dict, a Preencoded can't sit inside the result list
+        return Database.read(op.get("fields"))
+    return DB_dispatch(op)
+
+def _acked(units: list, ack: str, on_ack, build, durability: str = None):
+    """Queue [(DB, op, args)] and return build(results), results being one
+    per unit once all are acknowledged (None when ack is "none")."""
+    if ack not in DB.ACK_LEVELS[1:] or not units:
+        for Database, op, args in units:
+            Database.write(op, args, durability=durability)
+        return build(None if ack not in DB.ACK_LEVELS[1:] else [])
+    results = [None] * len(units)
+    left = [len(units)]
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def callback(i, result):
+        results[i] = result
+        with lock:
+            left[0] -= 1
+            if left[0]:
+                return
+        if on_ack is not None:
+            on_ack(build(results))
+        else:
+            done.set()
+
+    for i, (Database, op, args) in enumerate(units):
+        Database.write(op, args, ack, functools.partial(callback, i), durability)
+    if on_ack is not None:
+        return PENDING
+    done.wait(ACK_TIMEOUT)  # on timeout the missing results read as not ok
+    return build(results)
+
+
+# === event-loop front end === #
+class DBProtocol(FramedProtocol):
+    """One connection of the single-threaded front end: requests are
+    answered inline from the in-memory state (writes only enqueue to the
+    DB writer threads, acknowledged ones answer from a writer callback),
+    so no thread per connection is needed."""
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self._idle = None
+        self._replies = collections.deque()
+        addr = transport.get_extra_info("peername")
+        if addr[0] not in ALLOWED_HOSTS:
+            self.send({})
+            transport.close()
+            return
+        self._touch()
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        if self._idle is not None:
+            self._idle.cancel()
+
+    def message_received(self, msg):
+        self._touch()
+        # replies leave in request order, acknowledged writes may finish later
+        slot = [None, False]  # reply, ready
+        self._replies.append(slot)
+        loop = asyncio.get_running_loop()
+        resp = DB_dispatch(msg, on_ack=lambda resp: loop.call_soon_threadsafe(self._ready, slot, resp))
+        if resp is not PENDING:
+            self._ready(slot, resp)
+
+    def _ready(self, slot, resp):
+        slot[0], slot[1] = resp, True
+        while self._replies and self._replies[0][1]:
+            resp = self._replies.popleft()[0]
+            if not self.transport.is_closing():
+                self.send(resp)
+
+    def _touch(self):
+        # (re)arm the idle timeout
+        if self._idle is not None:
+            self._idle.cancel()
+        self._idle = asyncio.get_running_loop().call_later(IDLE_TIMEOUT, self.transport.close)
+
+def serve_loop(host: str, port: int):
+    async def run():
+        loop = asyncio.get_running_loop()
+        srv = await loop.create_server(DBProtocol, host, port, reuse_address=True, backlog=128)
+        print(f"[*] DB server (event loop) Listening on {host}:{port}")
+        async with srv:
+            await srv.serve_forever()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
 
-    conn.close()
-
-
-def main():
-    global player_db, developer_db, game_store_db#, room_db, DB_DICT
-    global DB_DICT
-    player_db = UDB(PLAYER_JSON)
-    developer_db = DDB(DEVELOPER_JSON)
-    game_store_db = GSDB(GAME_STORE_JSON)
-    # TODO other db    
-    
-    DB_DICT = {"player_db": player_db, "developer_db": developer_db, "game_store_db": game_store_db} #, "room_db": room_db, "game_store_db": game_store_db}
-
+def serve_threaded(host: str, port: int):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as DBsrv:
         DBsrv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        DBsrv.bind((DB_HOST, DB_PORT))
+        DBsrv.bind((host, port))
         DBsrv.listen(128)
-        print(f"[*] DB server Listening on {DB_HOST}:{DB_PORT}")
-        # logger.info(f"[*] DB server Listening on {DB_HOST}:{DB_PORT}")
+        print(f"[*] DB server Listening on {host}:{port}")
+        # logger.info(f"[*] DB server Listening on {host}:{port}")
         while True:
             try:
                 conn, addr = DBsrv.accept()
@@ -362,4 +962,59 @@ def main():
                 break
             th = threading.Thread(target=DB_handle_requset, args=(conn, addr), daemon=True)
             th.start()
-main()
\ No newline at end of file
+
+# default durability per collection (main() --durability NAME=LEVEL changes it):
+# accounts are batched, game store uploads are rare and worth an fsync each
+DB_DURABILITY = {"player_db": "async", "developer_db": "async", "game_store_db": "fsync"}
+
+def build_dbs(data_dir: str = None, durability: dict = None, **db_opts) -> dict:
+    global player_db, developer_db, game_store_db#, room_db, DB_DICT
+    global DB_DICT
+    def path(p):
+        # --data points every json file into another directory (benchmarks, tests)
+        return p if data_dir is None else os.path.join(data_dir, os.path.basename(p))
+    level = dict(DB_DURABILITY, **(durability or {}))
+    player_db = UDB(path(PLAYER_JSON), durability=level["player_db"], **db_opts)
+    developer_db = DDB(path(DEVELOPER_JSON), durability=level["developer_db"], **db_opts)
+    game_store_db = GSDB(path(GAME_STORE_JSON), durability=level["game_store_db"], **db_opts)
+    # TODO other db    
+    
+    DB_DICT = {"player_db": player_db, "developer_db": developer_db, "game_store_db": game_store_db} #, "room_db": room_db, "game_store_db": game_store_db}
+    return DB_DICT
+
+def main():
+    ap = argparse.ArgumentParser(description="DB server")
+    ap.add_argument("--mode", choices=["thread", "loop"], default="thread",
+                    help="thread per connection, or one asyncio event loop")
+    ap.add_argument("--host", default=DB_HOST)
+    ap.add_argument("--port", type=int, default=DB_PORT)
+    ap.add_argument("--allow", action="append", default=[], help="extra peer host allowed to connect")
+    ap.add_argument("--data", help="directory holding the json files (default: config paths)")
+    ap.add_argument("--wal", action="store_true", help="append changes to a log instead of rewriting the files")
+    ap.add_argument("--snapshot-every", type=int, default=1000, help="compact the WAL after this many records")
+    ap.add_argument("--compact-bytes", type=int, default=4 << 20, help="... or once the WAL is this big")
+    ap.add_argument("--engine", choices=sorted(ENGINES), default="json",
+                    help="storage engine; sqlite keeps <name>.sqlite3 next to the json files")
+    ap.add_argument("--segments", type=int, default=0,
+                    help="hash records into this many files per DB (see DB_migrate), 0 = one json file")
+    ap.add_argument("--durability", action="append", default=[], metavar="NAME=LEVEL",
+                    help="collection durability: memory, async or fsync (e.g. player_db=memory)")
+    args = ap.parse_args()
+
+    durability = {}
+    for opt in args.durability:
+        name, _, level = opt.partition("=")
+        if name not in DB_DURABILITY or level not in DB.DURABILITY:
+            ap.error(f"bad --durability {opt!r}")
+        durability[name] = level
+    ALLOWED_HOSTS.update(args.allow)
+    build_dbs(args.data, durability, wal=args.wal, snapshot_every=args.snapshot_every,
+              compact_bytes=args.compact_bytes, segments=args.segments, engine=args.engine)
+    install_stats_signal()  # kill -USR1 <pid> dumps traffic counters to stderr
+    if args.mode == "loop":
+        serve_loop(args.host, args.port)
+    else:
+        serve_threaded(args.host, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import os, json, tempfile, zlib, sqlite3
+from NP_hw3.Server.DB_record import Record
+
+# Storage engines of DB_server.DB: where a DB's records live on disk. The
+# DB keeps every record in memory and answers reads from there; an engine
+# only loads the records at startup and persists the changed ones when the
+# DB flushes (or compacts its WAL).
+#
+#   load() -> dict          the stored records; `seq` = newest WAL record inside
+#   seq_of(keys) -> int     newest WAL record inside the stored copy of `keys` (None = all)
+#   save(snap, keys, seq)   persist `keys` of snap (None = all records), remembering seq
+#   close()
+class Storage():
+    name = "?"
+    incremental = False  # save() only writes `keys`, so the DB must track changed keys
+
+    def __init__(self, path: str, volatile=()):
+        self.path = path
+        self.volatile = set(volatile)  # fields never written
+        self.seq = 0
+        self.fresh = False  # load() read another layout: save everything once
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def load(self) -> dict:
+        raise NotImplementedError
+
+    def seq_of(self, keys) -> int:
+        return self.seq
+
+    def save(self, snap: dict, keys, seq: int):
+        raise NotImplementedError
+
+    def close(self):
+        return
+
+    def stats(self) -> dict:
+        return {"engine": self.name, "files_written": self.files_written, "bytes_written": self.bytes_written}
+
+    def _persisted(self, rec):
+        # a record as written to disk: json, without its volatile fields
+        if isinstance(rec, Record):
+            return rec.to_json(skip=self.volatile)
+        if not self.volatile or not isinstance(rec, dict):
+            return rec
+        return {f: v for f, v in rec.items() if f not in self.volatile}
+
+class JsonStorage(Storage):
+    """One json file, or with segments=N the records hashed into N files
+    under <path>.d/ of which only those holding changed keys are rewritten."""
+    name = "json"
+
+    def __init__(self, path: str, volatile=(), segments: int = 0):
+        super().__init__(path, volatile)
+        self.segments = segments or 0  # None / 0 = one file
+        self.incremental = self.segments > 0
+        self.seg_dir = path + ".d"
+        self._seg_seq = None   # WAL seq inside each segment file
+        self._seg_keys = None  # keys living in each segment
+
+    def load(self) -> dict:
+        if self.segments and os.path.exists(os.path.join(self.seg_dir, "meta.json")):
+            data = self._load_segments()
+        elif self.segments:
+            # no segment files yet: start from the single file (if any)
+            data = self._load_single(create=False)
+            self.fresh = True
+        else:
+            _no_segments(self.path)
+            data = self._load_single(create=True)
+        if self.segments:
+            self._seg_keys = [set() for _ in range(self.segments)]
+            for k in data:
+                self._seg_keys[self._seg(k)].add(k)
+        return data
+
+    def seq_of(self, keys) -> int:
+        if self._seg_seq is None:
+            return self.seq
+        segs = range(self.segments) if keys is None else {self._seg(k) for k in keys}
+        return min(self._seg_seq[i] for i in segs)
+
+    def save(self, snap: dict, keys, seq: int):
+        if not self.segments:
+            out = {k: self._persisted(rec) for k, rec in snap.items()}
+            if seq:
+                # only with a log to line up with (WAL mode / a leftover
+                # log): the plain file stays a bare {key: record} map
+                out["__wal_seq__"] = seq
+            self._atomic_write(out, self.path)
+            return
+        self._write_segments(snap, keys, seq)
+
+    def _load_single(self, create: bool) -> dict:
+        if not os.path.exists(self.path):
+            if create:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump({}, f)
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                data = {}
+        except (json.JSONDecodeError, OSError):
+            data = {}
+        # snapshot written in WAL mode: records up to this seq are inside
+        self.seq = data.pop("__wal_seq__", 0)
+        return data
+
+    def _load_segments(self) -> dict:
+        with open(os.path.join(self.seg_dir, "meta.json"), "r", encoding="utf-8") as f:
+            n = json.load(f).get("segments")
+        if n != self.segments:
+            raise ValueError(f"{self.seg_dir} holds {n} segments, not {self.segments} (see DB_migrate)")
+        data = {}
+        self._seg_seq = [0] * n
+        for i in range(n):
+            try:
+                with open(self._seg_path(i), "r", encoding="utf-8") as f:
+                    seg = json.load(f)
+            except FileNotFoundError:
+                seg = {}
+            self._seg_seq[i] = seg.pop("__wal_seq__", 0)
+            data.update(seg)
+        self.seq = max(self._seg_seq, default=0)
+        return data
+
+    def _seg(self, key) -> int:
+        # crc32, not hash(): the same key must land in the same file every run
+        return zlib.crc32(str(key).encode("utf-8")) % self.segments
+
+    def _seg_path(self, i: int) -> str:
+        return os.path.join(self.seg_dir, f"seg-{i:03d}.json")
+
+    def _write_segments(self, snap: dict, keys, seq: int):
+        """Rewrite the segment files holding `keys` (None = all of them)
+        from `snap`; each file is replaced atomically and remembers `seq`."""
+        if keys is None:
+            segs = range(self.segments)
+            self._seg_keys = [set() for _ in segs]
+            for k in snap:
+                self._seg_keys[self._seg(k)].add(k)
+        else:
+            segs = set()
+            for k in keys:
+                i = self._seg(k)
+                segs.add(i)
+                if k in snap:
+                    self._seg_keys[i].add(k)
+                else:
+                    self._seg_keys[i].discard(k)
+        os.makedirs(self.seg_dir, exist_ok=True)
+        if self._seg_seq is None:
+            self._seg_seq = [0] * self.segments
+        for i in sorted(segs):
+            out = {k: self._persisted(snap[k]) for k in self._seg_keys[i] if k in snap}
+            out["__wal_seq__"] = seq
+            self._atomic_write(out, self._seg_path(i))
+            self._seg_seq[i] = seq
+        meta = os.path.join(self.seg_dir, "meta.json")
+        if not os.path.exists(meta):
+            # last: a directory without it is an unfinished first write
+            self._atomic_write({"segments": self.segments}, meta)
+
+    def _atomic_write(self, data: dict, path: str):
+        """write into tempfile → flush+fsync → os.replace (atomic)"""
+        dir_ = os.path.dirname(path) or "."
+        fd, tmp = tempfile.mkstemp(prefix=".tmp_", dir=dir_, text=True)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            os.replace(tmp, path)
+            self.files_written += 1
+            self.bytes_written += size
+        finally:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+
+class SqliteStorage(Storage):
+    """Embedded sqlite3 database next to the json file (<name>.sqlite3):
+    one row per record, the fields in `columns` copied into indexed
+    columns. WAL journal, and every save is one transaction, so the stored
+    records always match one DB version. On first start the json file (if
+    any) is imported."""
+    name = "sqlite"
+    incremental = True
+
+    def __init__(self, path: str, volatile=(), columns=()):
+        super().__init__(path, volatile)
+        self.json_path = path
+        self.path = os.path.splitext(path)[0] + ".sqlite3"
+        self.columns = tuple(columns)
+        # the writer thread saves, the thread that built the DB loads
+        self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")  # a commit is on disk, like the json fsync
+        cols = "".join(f", {c}" for c in self.columns)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS records (key TEXT PRIMARY KEY, data TEXT NOT NULL{cols})")
+        for c in self.columns:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS records_{c} ON records ({c})")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+        # fixed statements: sqlite3 prepares each once and reuses it from its cache
+        marks = ", ?" * len(self.columns)
+        updates = "".join(f", {c} = excluded.{c}" for c in self.columns)
+        self._upsert = (f"INSERT INTO records (key, data{cols}) VALUES (?, ?{marks}) "
+                        f"ON CONFLICT (key) DO UPDATE SET data = excluded.data{updates}")
+        self._delete = "DELETE FROM records WHERE key = ?"
+        self._set_seq = "INSERT INTO meta (name, value) VALUES ('wal_seq', ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value"
+
+    def load(self) -> dict:
+        data = {key: json.loads(rec) for key, rec in self.conn.execute("SELECT key, data FROM records")}
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'wal_seq'").fetchone()
+        if row is not None:
+            self.seq = row[0]
+        elif not data:
+            # never saved: take over the json file (if any)
+            _no_segments(self.json_path)
+            if os.path.exists(self.json_path):
+                old = JsonStorage(self.json_path)
+                data = old.load()
+                self.seq = old.seq
+                self.fresh = True
+        return data
+
+    def save(self, snap: dict, keys, seq: int):
+        try:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                if keys is None:
+                    cur.execute("DELETE FROM records")
+                    keys = snap.keys()
+                rows, gone, size = [], [], 0
+                for k in keys:
+                    if k in snap:
+                        rec = self._persisted(snap[k])
+                        text = json.dumps(rec, ensure_ascii=False, separators=(",", ":"))
+                        size += len(text)
+                        rows.append((k, text) + tuple(_column(rec, c) for c in self.columns))
+                    else:
+                        gone.append((k,))
+                cur.executemany(self._upsert, rows)
+                cur.executemany(self._delete, gone)
+                cur.execute(self._set_seq, (seq,))
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # the DB handles failed flushes as OSError (data stays dirty)
+            raise OSError(f"sqlite save failed: {e}") from e
+        self.seq = seq
+        self.files_written += 1
+        self.bytes_written += size
+
+    def close(self):
+        self.conn.close()
+
+def _no_segments(path: str):
+    # the records were split into <path>.d by DB_migrate: reading the
+    # single file would start from an empty DB and fork it from the segments
+    meta = os.path.join(path + ".d", "meta.json")
+    if os.path.exists(meta):
+        with open(meta, "r", encoding="utf-8") as f:
+            n = json.load(f).get("segments")
+        raise ValueError(f"{path}.d holds {n} segments: start with --segments {n}, or go back with DB_migrate --segments 0")
+
+def _column(rec, field):
+    # column value: scalars as they are, anything else as json
+    v = rec.get(field) if isinstance(rec, dict) else None
+    if v is None or isinstance(v, (str, int, float)):
+        return v
+    return json.dumps(v, ensure_ascii=False)
+
+ENGINES = {"json": JsonStorage, "sqlite": SqliteStorage}
+
+def open_storage(engine: str, path: str, volatile=(), segments: int = 0, columns=()) -> Storage:
+    if engine == "json":
+        return JsonStorage(path, volatile, segments)
+    if engine == "sqlite":
+        if segments:
+            raise ValueError("the sqlite engine has no segments")
+        return SqliteStorage(path, volatile, columns)
+    raise ValueError(f"unknown storage engine {engine!r}")
@@ -1,7 +1,8 @@
 import socket, threading, uuid
 # from loguru import # logger
 from NP_hw3.config import DEV_HOST, DEV_PORT, DB_HOST, DB_PORT, GAME_STORE_PATH
-from NP_hw3.TCP_tool import send_json, recv_json, set_keepalive
+from NP_hw3.TCP_tool import send_json, set_keepalive, get_reader, server_hello, instrument, stats_snapshot, install_stats_signal, recv_streams, file_sink
+from NP_hw3.Server.DB_pool import DBPool
 import os
 import pathlib
 class STATUS():
@@ -24,49 +25,66 @@ def breakdown_request(request: dict):
 def response_format(action, result, data:dict, msg):
     return {"action": action, "result": result, "data": data, "msg": msg}
 
-def DB_request(DB_type, action, data):
-    with socket.create_connection((DB_HOST, DB_PORT)) as db:
-        db.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        #  Send to DB for different db_type, action, data.
-        match action:
-            case 'create':
-                send_json(db, {"type": DB_type, "action": "create", "data": data})
-            case 'read':
-                send_json(db, {"type": DB_type, "action": "read", "data": data})
-            case 'update':
-                send_json(db, {"type": DB_type, "action": "update", "data": data})
-            case 'delete':
-                send_json(db, {"type": DB_type, "action": "delete", "data": data})
-            case 'query':
-                send_json(db, {"type": DB_type, "action": "query", "data": data})
-            case _:
-                print("")
-                # logger.info(f"{DB_type} DB_request: unknown action {action}")
-        
-        #  Receive the response
-        resp = recv_json(db)
-        db.close()
-    return resp
+# one pool per server process; sockets are opened on first use
+DB_POOL = DBPool(DB_HOST, DB_PORT)
+
+def DB_request(DB_type, action, data, fields=None, ack=None):
+    #  Send to DB for different db_type, action, data.
+    #  fields: only these keys of each record come back (read / query / find)
+    #  ack: "applied" / "durable" waits until the write is in memory / on disk, reply {"ok": bool}
+    if action not in ("create", "read", "update", "delete", "query", "find", "page"):
+        # logger.info(f"{DB_type} DB_request: unknown action {action}")
+        return {}
+    msg = {"type": DB_type, "action": action, "data": data}
+    if fields:
+        msg["fields"] = fields
+    if ack:
+        msg["ack"] = ack
+    return DB_POOL.request(msg)
+
+# game store fields shown in the store / game lists; comments are fetched on their own
+STORE_FIELDS = ["gamename", "author", "version", "max_players", "game_type", "last_update"]
 # ============= #
 
+# peers allowed to ask for the "stats" admin action
+STATS_HOSTS = ("127.0.0.1", "::1", DEV_HOST)
+
 def handle_client(conn: socket.socket, addr):
     set_keepalive(conn)
     # logger.info(f"[*] connected from {addr}")
     # === some variables === #
     username = None
     token_srv = None
+    reader = get_reader(conn)
+    instrument(conn, f"dev {addr[0]}:{addr[1]}")  # no-op unless NP_TCP_STATS is set
     # ====================== #
     try:
         while True:
-            request = recv_json(conn)
+            request = reader.recv_json()
+            if server_hello(conn, request):
+                # codec / compression negotiation, newer clients only
+                continue
+            if request.get("action") == "stats" and addr[0] in STATS_HOSTS:
+                # admin: traffic counters of this server (see TCP_tool.instrument)
+                send_json(conn, response_format(action="stats", result="ok", data=dict(stats_snapshot(), db_pool=DB_POOL.stats()), msg=""))
+                continue
             status, action, request_data, token = breakdown_request(request)
+            # upload_game / update_game: the game files follow the request as
+            # raw streams and go straight into the game folder; anything else
+            # sending streams gets them dropped
+            upload_error = None
+            if request.get("streams"):
+                dest = None
+                if status == STATUS.LOBBY and token == token_srv and username and action in ("upload_game", "update_game"):
+                    dest = pathlib.Path(GAME_STORE_PATH) / (request_data["gamename"] + "_" + username)
+                upload_error = recv_streams(reader, request["streams"], file_sink(dest) if dest is not None else None)
             match status:
                 case STATUS.INIT:
                     if action == "register":
                         regi_name = request_data["username"]
                         resp_db_query = DB_request(DB_type.DEVELOPER, "query", {"username" : regi_name})
-                        if resp_db_query == {}:
-                            DB_request(DB_type.DEVELOPER, "create", request_data)
+                        # durable: the account is on disk before we say so; not ok = taken meanwhile
+                        if resp_db_query == {} and DB_request(DB_type.DEVELOPER, "create", request_data, ack="durable").get("ok"):
                             send_json(conn, response_format(action=action, result="ok", data={}, msg="Register succuessfully"))
                         else:
                             send_json(conn, response_format(action, "error", {}, msg="Fail, change another username"))
@@ -83,7 +101,7 @@ def handle_client(conn: socket.socket, addr):
                         else:
                             username = login_name
                             token_srv = uuid.uuid4().hex
-                            DB_request(DB_type.DEVELOPER, "update", {"username": username, "status": STATUS_DB.LOBBY, "token": token_srv})
+                            DB_request(DB_type.DEVELOPER, "update", {"username": username, "status": STATUS_DB.LOBBY, "token": token_srv}, ack="applied")
                             send_json(conn, response_format(action=action, result="ok", data={"token": token_srv}, msg="Login successfully!"))
                     else:
                         send_json(conn, response_format(action=action, result="error", data={}, msg="Unknown operation"))
@@ -98,9 +116,15 @@ def handle_client(conn: socket.socket, addr):
                     if action == "update_game":
                         # receive game data and update to game store db
                         game_data = request_data
+                        if upload_error is not None:
+                            send_json(conn, response_format(action=action, result="error", data={}, msg=f"Failed to store game files: {upload_error}"))
+                            continue
                         # update config data to DB
                         # logger.info(f"Updating game '{game_data}' to GAME_STORE DB")
-                        DB_request(DB_type.GAME_STORE, "update", game_data)
+                        # the DB only keeps the config: leave the file list out of the
+                        # request (and so out of the DB's write-ahead log)
+                        db_data = {f: v for f, v in game_data.items() if f != "files"}
+                        DB_request(DB_type.GAME_STORE, "update", db_data, ack="durable")
                         # update files on server side
                         # create path to store game files
                         create_path = pathlib.Path(GAME_STORE_PATH)
@@ -110,21 +134,20 @@ def handle_client(conn: socket.socket, addr):
                         with open(create_path / folder_name / "config.json", 'w') as f:
                             import json
                             json.dump(game_data['config'], f, indent=4)
-                        # store each file
-                        for filename, filecontent in game_data['files'].items():
-                            with open(create_path / folder_name / filename, 'wb') as f:
-                                f.write(filecontent.encode('utf-8'))  # assuming filecontent is str, encode to bytes
-                        
+                        # the game files were stored as they arrived
                         send_json(conn, response_format(action=action, result="ok", data={}, msg="Update game successfully!"))
 
                     elif action == "manage_game":
                         # fetch all games from game store db
-                        resp_db_query = DB_request(DB_type.GAME_STORE, "query", {"username": username, "gamename": None})
+                        resp_db_query = DB_request(DB_type.GAME_STORE, "query", {"username": username, "gamename": None}, fields=STORE_FIELDS)
                         send_json(conn, response_format(action=action, result="ok", data={"game_list": resp_db_query}, msg="Fetch game list successfully!"))
 
                     elif action == "upload_game":
                         # receive game data and store to game store db
                         game_data = request_data
+                        if upload_error is not None:
+                            send_json(conn, response_format(action=action, result="error", data={}, msg=f"Failed to store game files: {upload_error}"))
+                            continue
                         # create game folder under GameStore, on server side
                         # create path to store game files
                         create_path = pathlib.Path(GAME_STORE_PATH)
@@ -135,15 +158,11 @@ def handle_client(conn: socket.socket, addr):
                         with open(create_path / folder_name / "config.json", 'w') as f:
                             import json
                             json.dump(game_data['config'], f, indent=4)
-                        # store each file
-                        for filename, filecontent in game_data['files'].items():
-                            with open(create_path / folder_name / filename, 'wb') as f:
-                                f.write(filecontent.encode('utf-8'))  # assuming filecontent is str, encode to bytes
-                        
+                        # the game files were stored as they arrived
                         # only store config data to DB
                         del game_data['files']
                         # logger.info(f"Storing game '{game_data}' to GAME_STORE DB")
-                        DB_request(DB_type.GAME_STORE, "create", game_data)
+                        DB_request(DB_type.GAME_STORE, "create", game_data, ack="durable")
                         send_json(conn, response_format(action=action, result="ok", data={}, msg="Upload game successfully!"))
 
                     elif action == "delete_game":
@@ -153,7 +172,7 @@ def handle_client(conn: socket.socket, addr):
                         create_path = pathlib.Path(GAME_STORE_PATH)
                         folder_name = game_data["gamename"] + "_" + username
                         game_data = {"gamename": folder_name}                        
-                        DB_request(DB_type.GAME_STORE, "delete", game_data)
+                        DB_request(DB_type.GAME_STORE, "delete", game_data, ack="durable")
                         # delete files on server side
                         # create path to store game files
 
@@ -182,6 +201,7 @@ def handle_client(conn: socket.socket, addr):
             DB_request(DB_type.DEVELOPER, "update", {"username": username, "status":STATUS_DB.INIT, "token":None})
 
 def main():
+    install_stats_signal()  # kill -USR1 <pid> dumps traffic counters to stderr
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv.bind((DEV_HOST, DEV_PORT))
@@ -1,7 +1,8 @@
 import socket, threading, uuid
 # from loguru import # logger
 from NP_hw3.config import LOBBY_HOST, LOBBY_PORT, DB_HOST, DB_PORT
-from NP_hw3.TCP_tool import send_json, recv_json, set_keepalive
+from NP_hw3.TCP_tool import send_json, set_keepalive, get_reader, server_hello, instrument, stats_snapshot, install_stats_signal, send_many, broadcast, send_files
+from NP_hw3.Server.DB_pool import DBPool
 import os
 import subprocess
 import pathlib
@@ -48,6 +49,21 @@ def breakdown_request(request: dict):
     return request["status"], request["action"], request["data"], request["token"]
 def response_format(action, result, data:dict, msg):
     return {"action": action, "result": result, "data": data, "msg": msg}
+def reply(conn, req_id, resp: dict, files: dict = None):
+    # answer the current request; echo its req_id so a pipelining client
+    # can tell this response from pushes (room_update, game_start, ...)
+    # files ({name: path}) follow the response as raw streams
+    if req_id is not None:
+        resp["req_id"] = req_id
+    if files:
+        send_files(conn, resp, files)
+    else:
+        send_json(conn, resp)
+
+def room_conns(players, skip=None):
+    # sockets of the players in a room (minus `skip`), for broadcast()
+    return [player_sockets[player_addr]["conn"] for player, player_addr, _ in players
+            if player != skip and player_addr in player_sockets]
 
 def find_free_port():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -56,29 +72,39 @@ def find_free_port():
     s.close()
     return port
 
-def DB_request(DB_type, action, data):
-    with socket.create_connection((DB_HOST, DB_PORT)) as db:
-        db.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        #  Send to DB for different db_type, action, data.
-        match action:
-            case 'create':
-                send_json(db, {"type": DB_type, "action": "create", "data": data})
-            case 'read':
-                send_json(db, {"type": DB_type, "action": "read", "data": data})
-            case 'update':
-                send_json(db, {"type": DB_type, "action": "update", "data": data})
-            case 'delete':
-                send_json(db, {"type": DB_type, "action": "delete", "data": data})
-            case 'query':
-                send_json(db, {"type": DB_type, "action": "query", "data": data})
-            case _:
-                print("")
-                # logger.info(f"{DB_type} DB_request: unknown action {action}")
-        
-        #  Receive the response
-        resp = recv_json(db)
-        db.close()
-    return resp
+# one pool per server process; sockets are opened on first use
+DB_POOL = DBPool(DB_HOST, DB_PORT)
+
+def DB_request(DB_type, action, data, fields=None, ack=None):
+    #  Send to DB for different db_type, action, data.
+    #  fields: only these keys of each record come back (read / query / find)
+    #  ack: "applied" / "durable" waits until the write is in memory / on disk, reply {"ok": bool}
+    if action not in ("create", "read", "update", "delete", "query", "find", "page"):
+        # logger.info(f"{DB_type} DB_request: unknown action {action}")
+        return {}
+    msg = {"type": DB_type, "action": action, "data": data}
+    if fields:
+        msg["fields"] = fields
+    if ack:
+        msg["ack"] = ack
+    return DB_POOL.request(msg)
+
+def DB_batch(ops: list, ack=None) -> list:
+    #  Several DB ops in one round trip: [{"type", "action", "data"}, ...] -> one result each.
+    #  The writes of one batch are applied together by the DB.
+    if not ops:
+        return []
+    msg = {"action": "batch", "ops": ops}
+    if ack:
+        msg["ack"] = ack
+    return DB_POOL.request(msg)
+
+def status_op(player, status, **extra):
+    return {"type": DB_type.PLAYER, "action": "update", "data": dict(extra, username=player, status=status)}
+
+# game store fields shown in the store / game lists; comments are fetched on their own
+STORE_FIELDS = ["gamename", "author", "version", "max_players", "game_type", "last_update"]
+SHOP_PAGE = 10  # games per open_shop page
 # ============= #
 def launch_game_server(game_floder_name, gamesrv_addr):
     p = subprocess.Popen(["python", "-m", "NP_hw3.Server.GameStore." + game_floder_name + "." + game_floder_name.rsplit('_', 1)[0]+ "_server",
@@ -87,46 +113,59 @@ def launch_game_server(game_floder_name, gamesrv_addr):
     time.sleep(1)
 
 
+# peers allowed to ask for the "stats" admin action
+STATS_HOSTS = ("127.0.0.1", "::1", LOBBY_HOST)
+
 def handle_client(conn: socket.socket, addr):
     set_keepalive(conn)
     # logger.info(f"[*] connected from {addr}")
     # === some variables === #
     username = None
     token_srv = None
+    reader = get_reader(conn)
+    instrument(conn, f"lobby {addr[0]}:{addr[1]}")  # no-op unless NP_TCP_STATS is set
     # ====================== #
     try:
         while True:
-            request = recv_json(conn)
+            request = reader.recv_json()
+            if server_hello(conn, request):
+                # codec / compression negotiation, newer clients only
+                continue
+            if request.get("action") == "stats" and addr[0] in STATS_HOSTS:
+                # admin: traffic counters of this server (see TCP_tool.instrument)
+                reply(conn, request.get("req_id"), response_format(action="stats", result="ok", data=dict(stats_snapshot(), db_pool=DB_POOL.stats()), msg=""))
+                continue
             status, action, request_data, token = breakdown_request(request)
+            req_id = request.get("req_id")
             match status:
                 case STATUS.INIT:
                     if action == "register":
                         regi_name = request_data["username"]
                         resp_db_query = DB_request(DB_type.PLAYER, "query", {"username" : regi_name})
-                        if resp_db_query == {}:
-                            DB_request(DB_type.PLAYER, "create", request_data)
-                            send_json(conn, response_format(action=action, result="ok", data={}, msg="Register succuessfully"))
+                        # durable: the account is on disk before we say so; not ok = taken meanwhile
+                        if resp_db_query == {} and DB_request(DB_type.PLAYER, "create", request_data, ack="durable").get("ok"):
+                            reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Register succuessfully"))
                         else:
-                            send_json(conn, response_format(action, "error", {}, msg="Fail, change another username"))
+                            reply(conn, req_id, response_format(action, "error", {}, msg="Fail, change another username"))
                     elif action == "login":
                         login_name = request_data["username"]
                         resp_db_query = DB_request(DB_type.PLAYER, "query", {"username" : login_name})
                         # Not find
                         if resp_db_query == {}:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Account doesn't exist!"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Account doesn't exist!"))
                         elif resp_db_query["password"] != request_data["password"]:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Wrong password!"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Wrong password!"))
                         else:
                             if resp_db_query["status"] != STATUS_DB.INIT:
-                                send_json(conn, response_format(action=action, result="error", data={}, msg="User already logged in!"))
+                                reply(conn, req_id, response_format(action=action, result="error", data={}, msg="User already logged in!"))
                                 continue
                             username = login_name
                             player_sockets[addr]["username"] = username
                             token_srv = uuid.uuid4().hex
-                            DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.LOBBY, "token": token_srv})
-                            send_json(conn, response_format(action=action, result="ok", data={"token": token_srv}, msg="Login successfully!"))
+                            DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.LOBBY, "token": token_srv}, ack="applied")
+                            reply(conn, req_id, response_format(action=action, result="ok", data={"token": token_srv}, msg="Login successfully!"))
                     else:
-                        send_json(conn, response_format(action=action, result="error", data={}, msg=""))
+                        reply(conn, req_id, response_format(action=action, result="error", data={}, msg=""))
                 case STATUS.LOBBY:
                     if token != token_srv:
                         # Not matching token, logout!
@@ -134,17 +173,26 @@ def handle_client(conn: socket.socket, addr):
                         DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.INIT, "token": None})
                         username = None
                         token_srv = None
-                        send_json(conn, response_format(action=action, result="token miss", data={"status_change": STATUS.INIT}, msg="Miss matching token, logout"))
+                        reply(conn, req_id, response_format(action=action, result="token miss", data={"status_change": STATUS.INIT}, msg="Miss matching token, logout"))
                         
                     elif action == "open_shop":
-                        resp_db_query = DB_request(DB_type.GAME_STORE, "read", {})
-                        send_json(conn, response_format(action=action, result="ok", data={"games": resp_db_query}, msg=""))
+                        # one page at a time: {"order": "last_update" | "name" | "popularity", "cursor": <"next" of the last page>}
+                        page_req = {"order": request_data.get("order"), "cursor": request_data.get("cursor"), "limit": request_data.get("limit") or SHOP_PAGE}
+                        resp_db_query = DB_request(DB_type.GAME_STORE, "page", page_req, fields=STORE_FIELDS)
+                        if "games" not in resp_db_query:
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Bad page request"))
+                            continue
+                        reply(conn, req_id, response_format(action=action, result="ok", data=resp_db_query, msg=""))
+                    elif action == "get_comments":
+                        # gamename is the store key, as in download_game / submit
+                        resp_db_query = DB_request(DB_type.GAME_STORE, "query", {"key": request_data["gamename"]}, fields=["comments"])
+                        reply(conn, req_id, response_format(action=action, result="ok", data={"comments": resp_db_query.get("comments", [])}, msg=""))
                     elif action == "download_game":
                         gamename = request_data["gamename"]
                         # directly read from GameStore
                         gamedir = GAME_STORE_DIR / gamename
                         if not gamedir.exists():
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Game not found"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Game not found"))
                             continue
                         # read config.json
                         with open(gamedir / "config.json", "r") as f:
@@ -152,22 +200,20 @@ def handle_client(conn: socket.socket, addr):
                             # turn string into dict
                             import json
                             config = json.loads(config)
-                        # read all files instead of server
-                        files_data = {}
+                        # all files instead of server, streamed after the reply a chunk at a time
+                        files = {}
                         for file in gamedir.iterdir():
                             if file.name == "config.json" or "server.py"in file.name  or "__pycache__" in file.name:
                                 continue
-                            with open(file, "rb") as f:
-                                # logger.info("printintintitnitn")
-                                files_data[file.name] = f.read().decode('utf-8')
-                        send_json(conn, response_format(action=action, result="ok", data={"config": config, "files": files_data}, msg="Download success"))
+                            files[file.name] = file
+                        reply(conn, req_id, response_format(action=action, result="ok", data={"config": config, "files": list(files)}, msg="Download success"), files)
                     elif action == "check_version":
                         gamename = request_data["gamename"]
                         user_version = request_data["version"]
                         # directly read from GameStore
                         gamedir = GAME_STORE_DIR / gamename
                         if not gamedir.exists():
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Game not found"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Game not found"))
                             continue
                         # read config.json
                         with open(gamedir / "config.json", "r") as f:
@@ -177,16 +223,16 @@ def handle_client(conn: socket.socket, addr):
                             config = json.loads(config)
 
                         if config["version"] == user_version:
-                            send_json(conn, response_format(action=action, result="ok", data={}, msg="You have the latest version"))
+                            reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="You have the latest version"))
                         else:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="New version released!"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="New version released!"))
                     elif action == "create_room":
                         # use dict
 
                         gamename = request_data["gamename"]
                         gamedir = GAME_STORE_DIR / gamename
                         if not gamedir.exists():
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Game not found"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Game not found"))
                             continue
                         # read config.json
                         with open(gamedir / "config.json", "r") as f:
@@ -209,7 +255,7 @@ def handle_client(conn: socket.socket, addr):
                         rooms[gamename][username] = room_info
                         # update player status
                         DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.ROOM})
-                        send_json(conn, response_format(action=action, result="ok", data={"room_id": username}, msg="Room created successfully"))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={"room_id": username}, msg="Room created successfully"))
                         # logger.info(f"Current rooms dict: {rooms}")
 
                     elif action == "list_rooms":
@@ -232,49 +278,47 @@ def handle_client(conn: socket.socket, addr):
                                 "max_players" : max_players,
                                 "has_password": info["room_password"] != ""
                             })
-                        send_json(conn, response_format(action=action, result="ok", data={"rooms": room_list}, msg=""))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={"rooms": room_list}, msg=""))
                     elif action == "join_room":
                         gamename = request_data["gamename"]
                         room_id = request_data["room_id"]
                         room_password = request_data.get("room_password", "")
                         if gamename not in rooms or room_id not in rooms[gamename]:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Room not found"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Room not found"))
                             continue
                         
                         room_info = rooms[gamename][room_id]
                         if len(room_info["players"]) >= room_info["max_players"]:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Full room"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Full room"))
                             continue                            
                         if room_info["room_password"] != room_password:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Wrong room password"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Wrong room password"))
                             continue
                         room_info["players"].append([username, addr, 0])
                         # update player status
                         DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.ROOM})
-                        send_json(conn, response_format(action=action, result="ok", data={}, msg="Joined room successfully"))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Joined room successfully"))
                         # notify other players about new player
-                        for player, player_addr, _ in room_info["players"]:
-                            if player == username:
-                                continue
-                            player_conn = player_sockets[player_addr]["conn"]
-                            send_json(player_conn, response_format(action="room_update", result="ok", data={"players": room_info["players"]}, msg=f"Player {username} joined the room"))
+                        broadcast(room_conns(room_info["players"], skip=username), [response_format(action="room_update", result="ok", data={"players": room_info["players"]}, msg=f"Player {username} joined the room")])
                     elif action == "logout":
                         DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.INIT, "token": None})
                         username = None
                         token_srv = None
-                        send_json(conn, response_format(action=action, result="ok", data={}, msg="Logout successfully!"))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Logout successfully!"))
                     elif action == "check_play":
-                        resp_db_query = DB_request(DB_type.PLAYER, "query", data={"username": username})
-                        if request_data["gamename"] in resp_db_query["have_play"]:
-                            send_json(conn, response_format(action=action, result="ok", data={}, msg="Ok"))
+                        # the DB checks its have_play set, the list itself stays there
+                        resp_db_query = DB_request(DB_type.PLAYER, "query", data={"username": username, "play": request_data["gamename"]})
+                        if resp_db_query.get("played"):
+                            reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Ok"))
                         else:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="Please play once."))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Please play once."))
                     elif action == "submit":
                         newcomment = (request_data["comment"], username, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()))
-                        DB_request(DB_type.GAME_STORE, "update", data={"gamename":request_data["gamename"], "new_comment": newcomment})
-                        send_json(conn, response_format(action=action, result="ok", data={}, msg="Add comment!"))
+                        # applied: a get_comments right after must already see it
+                        DB_request(DB_type.GAME_STORE, "update", data={"gamename":request_data["gamename"], "new_comment": newcomment}, ack="applied")
+                        reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Add comment!"))
                     else:
-                        send_json(conn, response_format(action=action, result="error", data={}, msg="Unknown operation"))
+                        reply(conn, req_id, response_format(action=action, result="error", data={}, msg="Unknown operation"))
 
                 case STATUS.ROOM:
                     player_room = None
@@ -288,34 +332,33 @@ def handle_client(conn: socket.socket, addr):
                         username = None
                         token_srv = None
                         DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.INIT, "token": None})
-                        send_json(conn, response_format(action=action, result="token miss", data={"status_change": STATUS.INIT}, msg="Miss matching token, logout"))
+                        reply(conn, req_id, response_format(action=action, result="token miss", data={"status_change": STATUS.INIT}, msg="Miss matching token, logout"))
                     elif action == "list_players_in_room":
                         if player_room is None:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="You are not in any room"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="You are not in any room"))
                             continue
                         player_list = [[player, _ , ready] for player, _ , ready in player_room["players"]]
-                        send_json(conn, response_format(action=action, result="ok", data={"players": player_list, "host": player_room["host"], "room_password": player_room["room_password"]}, msg=""))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={"players": player_list, "host": player_room["host"], "room_password": player_room["room_password"]}, msg=""))
                     elif action == "leave_room":
                         if player_room is None:
-                            send_json(conn, response_format(action=action, result="error", data={}, msg="You are not in any room"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={}, msg="You are not in any room"))
                             continue
                         # remove player from room
                         player_room["players"] = [[player, addr, ready] for player, addr, ready in player_room["players"] if player != username]
                         # host leave
                         if player_room["host"] == username:
-                            for player, player_addr, ready in player_room["players"]:
-                                player_conn = player_sockets[player_addr]["conn"]
-                                send_json(player_conn, response_format(action="room_closed", result="ok", data={}, msg="Host closed the room!"))
-                                DB_request(DB_type.PLAYER, "update", {"username": player, "status": STATUS_DB.LOBBY})
+                            broadcast(room_conns(player_room["players"]), [response_format(action="room_closed", result="ok", data={}, msg="Host closed the room!")])
+                            # every member back to the lobby, plus the host below, in one batch
+                            status_ops = [status_op(player, STATUS_DB.LOBBY) for player, player_addr, ready in player_room["players"]]
                             player_room["players"] = []
+                        else:
+                            status_ops = []
 
                         # update player status
-                        DB_request(DB_type.PLAYER, "update", {"username": username, "status": STATUS_DB.LOBBY})
-                        send_json(conn, response_format(action=action, result="ok", data={}, msg="Left room successfully"))
+                        DB_batch(status_ops + [status_op(username, STATUS_DB.LOBBY)])
+                        reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Left room successfully"))
                         # notify other players about player leaving
-                        for player, player_addr, _ in player_room["players"]:
-                            player_conn = player_sockets[player_addr]["conn"]
-                            send_json(player_conn, response_format(action="room_update", result="ok", data={"players": player_room["players"]}, msg=f"Player {username} left the room"))
+                        broadcast(room_conns(player_room["players"]), [response_format(action="room_update", result="ok", data={"players": player_room["players"]}, msg=f"Player {username} left the room")])
 
                         if player_room["players"] == []:
                             # close room
@@ -327,7 +370,7 @@ def handle_client(conn: socket.socket, addr):
                                 player_room["players"][idx][2] = True if not player_room["players"][idx][2] else False
                                 break
                             idx += 1
-                        send_json(conn, response_format(action=action, result="ok", data={}, msg="Cancel Ready" if ready else "ready"))
+                        reply(conn, req_id, response_format(action=action, result="ok", data={}, msg="Cancel Ready" if ready else "ready"))
                         
 
                         host_addr = player_room["players"][0][1]
@@ -342,15 +385,18 @@ def handle_client(conn: socket.socket, addr):
                             else:
                                 break
                         if cnt != player_room["max_players"]:
-                            send_json(conn, response_format(action=action, result="error", data={"type": "wait"}, msg="Not everyone is ready!"))
+                            reply(conn, req_id, response_format(action=action, result="error", data={"type": "wait"}, msg="Not everyone is ready!"))
                             continue
                         # check game version
                         gamedir = GAME_STORE_DIR / game
                         if not gamedir.exists():
                             for player, player_addr, ready in player_room["players"]:
-                                player_conn = player_sockets[player_addr]["conn"]
-                                send_json(player_conn, response_format(action="room_closed", result="ok", data={}, msg="Game have been removed."))
-                                DB_request(DB_type.PLAYER, "update", {"username": player, "status": STATUS_DB.LOBBY})
+                                # the host's copy answers its start_game request
+                                if player_addr == addr:
+                                    reply(conn, req_id, response_format(action="room_closed", result="ok", data={}, msg="Game have been removed."))
+                                else:
+                                    send_json(player_sockets[player_addr]["conn"], response_format(action="room_closed", result="ok", data={}, msg="Game have been removed."))
+                            DB_batch([status_op(player, STATUS_DB.LOBBY) for player, player_addr, ready in player_room["players"]])
                             del rooms[gamename][room_id]
                             continue
                         # read config.json
@@ -363,9 +409,12 @@ def handle_client(conn: socket.socket, addr):
                         # if not same version, notify all player to update game, and leave room
                         if player_room["version"] != config["version"]:
                             for player, player_addr, ready in player_room["players"]:
-                                player_conn = player_sockets[player_addr]["conn"]
-                                send_json(player_conn, response_format(action="room_closed", result="ok", data={}, msg="Please update the game version!"))
-                                DB_request(DB_type.PLAYER, "update", {"username": player, "status": STATUS_DB.LOBBY})
+                                # the host's copy answers its start_game request
+                                if player_addr == addr:
+                                    reply(conn, req_id, response_format(action="room_closed", result="ok", data={}, msg="Please update the game version!"))
+                                else:
+                                    send_json(player_sockets[player_addr]["conn"], response_format(action="room_closed", result="ok", data={}, msg="Please update the game version!"))
+                            DB_batch([status_op(player, STATUS_DB.LOBBY) for player, player_addr, ready in player_room["players"]])
                             del rooms[gamename][room_id]
                         # if ok -> play game
                         # fork a thread to run game server at given addr, port
@@ -374,19 +423,17 @@ def handle_client(conn: socket.socket, addr):
                         th = threading.Thread(target=launch_game_server, args=(game, gameaddr, ), daemon=True)
                         th.start()
 
-                        # send info to player
-                        for player, player_addr, _ in player_room["players"]:
-                            player_conn = player_sockets[player_addr]["conn"]
-                            send_json(player_conn, response_format(action="game_start", result="ok", data={}, msg="GameStart"))
-                        
-                        # send game info
-                        for player, player_addr, _ in player_room["players"]:
-                            player_conn = player_sockets[player_addr]["conn"]
-                            send_json(player_conn, response_format(action="game_info", result="ok", data={"gameaddr": gameaddr}, msg="game server Ip address"))
+                        # send game_start + game info to every player, both frames in one write;
+                        # the host's game_start answers its start_game request
+                        game_start = response_format(action="game_start", result="ok", data={}, msg="GameStart")
+                        game_info = response_format(action="game_info", result="ok", data={"gameaddr": gameaddr}, msg="game server Ip address")
+                        broadcast(room_conns(player_room["players"], skip=username), [game_start, game_info])
+                        if req_id is not None:
+                            game_start = dict(game_start, req_id=req_id)
+                        send_many(conn, [game_start, game_info])
                         
-                        # update play
-                        for player, player_addr, _ in player_room["players"]:
-                            DB_request(DB_type.PLAYER, action="update", data={"username": player, "play": gamename})
+                        # update play, one round trip for the whole room
+                        DB_batch([{"type": DB_type.PLAYER, "action": "update", "data": {"username": player, "play": gamename}} for player, player_addr, _ in player_room["players"]])
 
     except (ConnectionError, OSError) as e:
         print(f"[!] {addr} disconnected: {e}")
@@ -395,6 +442,8 @@ def handle_client(conn: socket.socket, addr):
         conn.close()
         # remove from the room when unexpected disconnection
         
+        # status updates for everyone involved, sent as one batch at the end
+        status_ops = []
         # Find which room the player is in and remove them
         if username != None:
             for gamename, game_rooms in rooms.items():
@@ -412,29 +461,20 @@ def handle_client(conn: socket.socket, addr):
                         if room_info["host"] == username:
                             # logger.info(f"[!] Host {username} disconnected, closing room {room_id}")
                             # Notify all remaining players that room is closed
+                            for player_conn, e in broadcast(room_conns(room_info["players"]), [response_format(action="room_closed", result="ok", data={}, msg="Host disconnected, room closed!")]):
+                                print(f"[!] Failed to notify {player_conn}: {e}")
                             for player, player_addr, _ in room_info["players"]:
                                 if player_addr in player_sockets:
-                                    try:
-                                        player_conn = player_sockets[player_addr]["conn"]
-                                        send_json(player_conn, response_format(action="room_closed", result="ok", data={}, msg="Host disconnected, room closed!"))
-                                        DB_request(DB_type.PLAYER, "update", {"username": player, "status": STATUS_DB.LOBBY})
-                                    except:
-                                        print(f"[!] Failed to notify player {player} at {player_addr}")
-                                        # logger.info(f"[!] Failed to notify player {player} at {player_addr}")
+                                    status_ops.append(status_op(player, STATUS_DB.LOBBY))
                             # Close the room
                             del rooms[gamename][room_id]
                             # logger.info(f"[!] Room {room_id} closed")
                         else:
                             # Notify host and other players about the disconnection
                             # logger.info(f"[!] Player {username} disconnected from room {room_id}")
-                            for player, player_addr, _ in room_info["players"]:
-                                if player_addr in player_sockets:
-                                    try:
-                                        player_conn = player_sockets[player_addr]["conn"]
-                                        send_json(player_conn, response_format(action="room_update", result="ok", data={"players": room_info["players"]}, msg=f"Player {username} disconnected from the room"))
-                                    except:
-                                        print(f"[!] Failed to notify player {player} at {player_addr}")
-                                        # logger.info(f"[!] Failed to notify player {player} at {player_addr}")
+                            for player_conn, e in broadcast(room_conns(room_info["players"]), [response_format(action="room_update", result="ok", data={"players": room_info["players"]}, msg=f"Player {username} disconnected from the room")]):
+                                print(f"[!] Failed to notify {player_conn}: {e}")
+                                # logger.info(f"[!] Failed to notify player {player} at {player_addr}")
                             
                             # If room is empty, close it
                             if room_info["players"] == []:
@@ -444,9 +484,14 @@ def handle_client(conn: socket.socket, addr):
         # logger.info(f"[*] closed {addr}")
         if username != None:
             # set to logout
-            DB_request(DB_type.PLAYER, "update", {"username": username, "status":STATUS_DB.INIT, "token":None})
+            status_ops.append(status_op(username, STATUS_DB.INIT, token=None))
+        try:
+            DB_batch(status_ops)
+        except (ConnectionError, OSError) as e:
+            print(f"[!] Failed to update players {[op['data']['username'] for op in status_ops]}: {e}")
 
 def main():
+    install_stats_signal()  # kill -USR1 <pid> dumps traffic counters to stderr
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv.bind((LOBBY_HOST, LOBBY_PORT))
@@ -0,0 +1,187 @@
+import asyncio, weakref
+from NP_hw3.TCP_tool import (FrameBuffer, MessageAssembler, MORE, ProtocolError, ZStats,
+                             message_frames, stream_frames,
+                             hello_offer, hello_answer, hello_result, is_hello)
+
+# asyncio counterpart of TCP_tool: same wire format (length prefix + flags,
+# codecs, zlib, streams), so a server can be moved to an event loop while
+# its peers keep using the blocking helpers.
+
+# transport write buffer size above which drain() / FramedProtocol.drain() block
+WRITE_HIGH_WATER = 64 * 1024
+
+# === stream reader / writer API === #
+class AsyncFrameReader():
+    """Frame reader for an asyncio.StreamReader. Reads are cancellation
+    safe: the only await is StreamReader.read(), whose bytes go straight
+    into the FrameBuffer, so a cancelled read_message() loses nothing and
+    a half-received frame or stream is picked up by the next call."""
+    def __init__(self, reader: asyncio.StreamReader, bufsize: int = 65536, max_frame: int = None):
+        self.reader = reader
+        self.buf = FrameBuffer(bufsize, max_frame)
+        self.asm = MessageAssembler()
+        self.zstats = self.asm.zstats
+
+    async def read_frame(self):
+        # -> (flags, body), see FrameBuffer.next_frame
+        while True:
+            frame = self.buf.next_frame()
+            if frame is not None:
+                return frame
+            data = await self.reader.read(max(self.buf.need(), 65536))
+            if not data:
+                raise ConnectionError("peer closed")
+            self.buf.feed(data)
+
+    async def read_message(self):
+        while True:
+            msg = self.asm.push(*await self.read_frame())
+            if msg is not MORE:
+                return msg
+
+    async def iter_stream(self, sid: int):
+        while True:
+            chunk = self.asm.stream_chunk(sid, *await self.read_frame())
+            if chunk is None:
+                return
+            yield bytes(chunk)
+
+class _WriterState():
+    __slots__ = ("codec", "compress_min", "zstats")
+    def __init__(self):
+        self.codec = "json"
+        self.compress_min = None
+        self.zstats = ZStats()
+
+_readers = weakref.WeakKeyDictionary()
+_writers = weakref.WeakKeyDictionary()
+
+def get_reader(reader: asyncio.StreamReader) -> AsyncFrameReader:
+    r = _readers.get(reader)
+    if r is None:
+        r = _readers[reader] = AsyncFrameReader(reader)
+    return r
+
+def _state(writer: asyncio.StreamWriter) -> _WriterState:
+    st = _writers.get(writer)
+    if st is None:
+        st = _writers[writer] = _WriterState()
+    return st
+
+def configure_writer(writer: asyncio.StreamWriter, high_water: int = WRITE_HIGH_WATER):
+    # drain() only waits once more than high_water bytes are queued
+    writer.transport.set_write_buffer_limits(high=high_water)
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Read one message (same as TCP_tool.recv_json)."""
+    return await get_reader(reader).read_message()
+
+async def write_frame(writer: asyncio.StreamWriter, obj, drain: bool = True):
+    """Write one message (same as TCP_tool.send_json) and wait for the
+    transport buffer to drop below the high-water mark."""
+    st = _state(writer)
+    writer.writelines(message_frames(obj, st.codec, st.compress_min, st.zstats))
+    if drain:
+        await writer.drain()
+
+async def write_stream(writer: asyncio.StreamWriter, header: dict, chunks):
+    # drains after every frame, so a big stream never piles up in memory
+    st = _state(writer)
+    for frame in stream_frames(header, chunks, 0, st.compress_min, st.zstats):
+        writer.write(frame)
+        await writer.drain()
+
+async def client_hello(reader, writer, codecs: list = None, compress: bool = True) -> str:
+    await write_frame(writer, hello_offer(codecs, compress))
+    st = _state(writer)
+    st.codec, st.compress_min = hello_result(await read_frame(reader))
+    get_reader(reader).asm.allow(st.codec, st.compress_min)
+    return st.codec
+
+async def server_hello(reader, writer, req: dict, codecs: list = None, compress: bool = True) -> bool:
+    if not is_hello(req):
+        return False
+    answer = hello_answer(req, codecs, compress)
+    await write_frame(writer, answer)
+    st = _state(writer)
+    st.codec, st.compress_min = hello_result(answer)
+    get_reader(reader).asm.allow(st.codec, st.compress_min)
+    return True
+
+# === protocol API === #
+class FramedProtocol(asyncio.Protocol):
+    """asyncio.Protocol speaking the TCP_tool framing. Subclasses override
+    message_received(); raw streams arrive as their header (with "sid")
+    followed by stream_data(sid, chunk) calls and a final stream_data(sid, None).
+    Hellos are answered automatically."""
+    high_water = WRITE_HIGH_WATER
+
+    def __init__(self):
+        self.transport = None
+        self.codec = "json"
+        self.compress_min = None
+        self._buf = FrameBuffer()
+        self._asm = MessageAssembler()
+        self.zstats = self._asm.zstats
+        self._raw_sid = None
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    # --- overridables --- #
+    def message_received(self, msg):
+        pass
+
+    def stream_data(self, sid: int, chunk):
+        pass
+
+    # --- asyncio callbacks --- #
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.high_water)
+
+    def connection_lost(self, exc):
+        self._can_write.set()
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def data_received(self, data):
+        self._buf.feed(data)
+        try:
+            while True:
+                frame = self._buf.next_frame()
+                if frame is None:
+                    return
+                if self._raw_sid is not None:
+                    chunk = self._asm.stream_chunk(self._raw_sid, *frame)
+                    sid = self._raw_sid
+                    if chunk is None:
+                        self._raw_sid = None
+                    self.stream_data(sid, None if chunk is None else bytes(chunk))
+                    continue
+                msg = self._asm.push(*frame)
+                if msg is MORE:
+                    continue
+                if is_hello(msg):
+                    answer = hello_answer(msg)
+                    self.send(answer)
+                    self.codec, self.compress_min = hello_result(answer)
+                    self._asm.allow(self.codec, self.compress_min)
+                    continue
+                if self._asm.raw_sid is not None:
+                    self._raw_sid, self._asm.raw_sid = self._asm.raw_sid, None
+                self.message_received(msg)
+        except (ProtocolError, ValueError) as e:
+            print(f"[!] framing error: {e}")
+            self.transport.close()
+
+    # --- sending --- #
+    def send(self, obj):
+        self.transport.writelines(message_frames(obj, self.codec, self.compress_min, self.zstats))
+
+    async def drain(self):
+        # wait while the transport buffer is above high_water
+        await self._can_write.wait()
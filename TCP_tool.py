@@ -1,4 +1,171 @@
-import socket, json, struct
+import socket, json, struct, threading, weakref, itertools, zlib, queue, os, sys, time
+from concurrent.futures import Future
+from NP_hw3 import msgpack_codec
+
+# Wire format: 4-byte big-endian header, low 24 bits = body length,
+# high 8 bits = flags. Plain frames have no flags set, so a header is
+# the same as the old bare length prefix.
+MAX_FRAME = 65536          # largest body accepted in one frame (DoS guard)
+HDR = struct.Struct("!I")
+LEN_MASK = 0x00FFFFFF
+FLAG_STREAM = 0x80
+FLAG_MSGPACK = 0x40   # body is msgpack instead of utf-8 json
+FLAG_ZLIB = 0x20      # body is zlib-compressed (applied after the codec)
+
+# frames below this size are never compressed: control messages like
+# ready_up would only pay latency for it
+COMPRESS_MIN = 1024
+COMPRESS_LEVEL = 1    # favour speed, catalog/file text still shrinks a lot
+# a zlib body may inflate to at most INFLATE_RATIO times its size (never
+# more than MAX_INFLATE), so a small frame can't blow up the receiver's
+# memory past what MAX_FRAME allows; senders leave bodies beyond that uncompressed
+MAX_INFLATE = 16 << 20
+INFLATE_RATIO = 64
+
+# Stream frames (FLAG_STREAM) carry a kind byte and a stream id before the payload.
+# BEGIN holds a json header, CHUNK holds raw bytes, END is empty. A json
+# message bigger than MAX_FRAME is sent as a stream with header {"json": true};
+# the codec of the reassembled body is given by the flags of the BEGIN frame.
+STREAM_HDR = struct.Struct("!BI")
+STREAM_BEGIN, STREAM_CHUNK, STREAM_END = 0, 1, 2
+_stream_ids = itertools.count(1)
+
+class ProtocolError(ConnectionError):
+    pass
+
+class ZStats():
+    """Body bytes before (raw) and after (wire) compression, per direction."""
+    __slots__ = ("frames_in", "zframes_in", "raw_in", "wire_in",
+                 "frames_out", "zframes_out", "raw_out", "wire_out")
+    def __init__(self):
+        for k in self.__slots__:
+            setattr(self, k, 0)
+
+    def count_in(self, flags: int, raw: int, wire: int):
+        self.frames_in += 1
+        self.raw_in += raw
+        self.wire_in += wire
+        if flags & FLAG_ZLIB:
+            self.zframes_in += 1
+
+    def count_out(self, flags: int, raw: int, wire: int):
+        self.frames_out += 1
+        self.raw_out += raw
+        self.wire_out += wire
+        if flags & FLAG_ZLIB:
+            self.zframes_out += 1
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+# process-wide totals; updated without a lock, good enough for monitoring
+ZSTATS_TOTAL = ZStats()
+
+# === traffic instrumentation (opt-in) === #
+# instrument(sock) makes send_json/recv_json on that socket count frames,
+# bytes, encode/decode time and time spent blocked in send, per
+# connection and per "action". Set NP_TCP_STATS=1 to turn it on in the servers.
+STATS_ENABLED = os.environ.get("NP_TCP_STATS", "") not in ("", "0")
+STAT_FIELDS = ("frames_in", "bytes_in", "frames_out", "bytes_out", "decode_s", "encode_s", "send_s")
+
+def _zero() -> dict:
+    return dict.fromkeys(STAT_FIELDS, 0)
+
+class TrafficStats():
+    def __init__(self, label: str):
+        self.label = label
+        self.opened = time.time()
+        self.total = _zero()
+        self.by_action = {}
+        self._lock = threading.Lock()
+
+    def add(self, action, **vals):
+        action = action if isinstance(action, str) else "?"
+        with self._lock:
+            per = self.by_action.get(action)
+            if per is None:
+                per = self.by_action[action] = _zero()
+            for k, v in vals.items():
+                self.total[k] += v
+                per[k] += v
+        _ACTION_TOTAL.add_action(action, vals)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"label": self.label, "opened": self.opened, "total": dict(self.total),
+                    "by_action": {a: dict(v) for a, v in self.by_action.items()}}
+
+class _ActionTotal():
+    # process-wide per-action counters, kept after connections close
+    def __init__(self):
+        self.by_action = {}
+        self._lock = threading.Lock()
+
+    def add_action(self, action: str, vals: dict):
+        with self._lock:
+            per = self.by_action.get(action)
+            if per is None:
+                per = self.by_action[action] = _zero()
+            for k, v in vals.items():
+                per[k] += v
+
+_ACTION_TOTAL = _ActionTotal()
+_instrumented = weakref.WeakKeyDictionary()  # sock -> TrafficStats
+
+def _action(msg):
+    return msg.get("action") if isinstance(msg, dict) else None
+
+# === codecs === #
+# The frame flags say which codec / compression a body uses; the hello
+# handshake decides which ones each side may send, and a receiver rejects
+# the others (a peer that never says hello sends and gets plain json).
+CODEC_FLAGS = {"json": 0, "msgpack": FLAG_MSGPACK}
+# offered in our hello, best first. The in-tree msgpack is pure python and
+# slower than the C json encoder, so only offer it when the C lib is there:
+# the optional `msgpack` package (see README). Without it every hop,
+# including Lobby/Developer -> DB, negotiates json.
+CODECS = ["msgpack", "json"] if msgpack_codec.HAVE_FAST else ["json"]
+
+def encode(obj, codec: str = "json"):
+    # -> (flags, body)
+    if codec == "msgpack":
+        return FLAG_MSGPACK, msgpack_codec.packb(obj)
+    return 0, json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def compress(flags: int, body: bytes, compress_min):
+    # compress_min None = compression not negotiated on this connection
+    if compress_min is None or len(body) < compress_min:
+        return flags, body
+    z = zlib.compress(body, COMPRESS_LEVEL)
+    if len(z) >= len(body) or len(body) > inflate_cap(len(z)):
+        return flags, body
+    return flags | FLAG_ZLIB, z
+
+def inflate_cap(wire: int) -> int:
+    # largest body a zlib body of `wire` bytes may inflate to
+    return min(MAX_INFLATE, max(wire, MAX_FRAME) * INFLATE_RATIO)
+
+def inflate(body) -> bytes:
+    d = zlib.decompressobj()
+    try:
+        out = d.decompress(body, inflate_cap(len(body)))
+    except zlib.error as e:
+        raise ProtocolError(f"bad zlib body: {e}") from e
+    if d.unconsumed_tail:
+        raise ProtocolError(f"zlib body of {len(body)} bytes inflates past {inflate_cap(len(body))}")
+    return out
+
+def accepted_flags(codec: str, compress_min) -> int:
+    # body flags a peer may send after agreeing on codec / compression
+    return CODEC_FLAGS[codec] | (FLAG_ZLIB if compress_min is not None else 0)
+
+def decode(flags: int, body):
+    if flags & FLAG_ZLIB:
+        body = inflate(body)
+    if flags & FLAG_MSGPACK:
+        return msgpack_codec.unpackb(body)
+    return json.loads(str(body, "utf-8") if isinstance(body, memoryview) else body)
+
 def set_keepalive(sock):
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
     try:
@@ -11,25 +178,694 @@ def set_keepalive(sock):
         pass
 
 def recvn(sock: socket.socket, n: int) -> bytes:
-    buf = b""
-    while len(buf) < n:
-        chunk = sock.recv(n - len(buf))
-        if not chunk:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:], n - got)
+        if not k:
             raise ConnectionError("peer closed")
-        buf += chunk
-    if len(buf) > 65536:
-        return {}
-    
-    return buf
+        got += k
+    return bytes(buf)
+
+# === sans-io frame parsing (shared with TCP_async) === #
+class FrameBuffer():
+    """Reusable bytearray that length-prefixed frames are cut out of,
+    several per read when available. Does no I/O itself: fill it through
+    writable()/advance() (recv_into) or feed(), then call next_frame()."""
+    def __init__(self, bufsize: int = 65536, max_frame: int = None):
+        self.max_frame = max_frame  # None -> module MAX_FRAME
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0  # first unread byte
+        self._end = 0    # end of valid data
+        self._skip = 0   # bytes left of an oversized body being dropped
+        self._skip_flags = 0
+
+    def pending(self) -> int:
+        # bytes already buffered, select() can't see them
+        return self._end - self._start
+
+    def need(self) -> int:
+        # bytes that must still arrive before next_frame() can return
+        have = self._end - self._start
+        if self._skip:
+            return 1
+        if have < HDR.size:
+            return HDR.size - have
+        n = HDR.unpack_from(self._buf, self._start)[0] & LEN_MASK
+        if n > (self.max_frame or MAX_FRAME):
+            return 1
+        return max(1, HDR.size + n - have)
+
+    def writable(self, need: int = 1) -> memoryview:
+        # free tail of the buffer with room for at least `need` more bytes;
+        # compacts first, and grows only if one frame doesn't fit
+        if len(self._buf) - self._end < need:
+            size = self._end - self._start
+            if size + need > len(self._buf):
+                new = bytearray(max(size + need, 2 * len(self._buf)))
+                new[:size] = self._view[self._start:self._end]
+                self._buf = new
+                self._view = memoryview(new)
+            else:
+                self._buf[:size] = self._view[self._start:self._end]
+            self._start, self._end = 0, size
+        return self._view[self._end:]
+
+    def advance(self, n: int):
+        self._end += n
+
+    def feed(self, data):
+        n = len(data)
+        self.writable(n)[:n] = data
+        self._end += n
+
+    def next_frame(self):
+        # -> (flags, body), or None if more bytes are needed. body is a view
+        # into the buffer, only valid until the next call; body is None
+        # when the frame was bigger than max_frame (it is dropped unbuffered)
+        if self._skip:
+            take = min(self._skip, self._end - self._start)
+            self._start += take
+            self._skip -= take
+            if self._skip:
+                return None
+            return self._skip_flags, None
+        if self._end - self._start < HDR.size:
+            return None
+        word = HDR.unpack_from(self._buf, self._start)[0]
+        flags, n = word >> 24, word & LEN_MASK
+        if n > (self.max_frame or MAX_FRAME):
+            self._start += HDR.size
+            self._skip, self._skip_flags = n, flags
+            return self.next_frame()
+        if self._end - self._start < HDR.size + n:
+            return None
+        body = self._view[self._start + HDR.size:self._start + HDR.size + n]
+        self._start += HDR.size + n
+        if self._start == self._end:
+            self._start = self._end = 0
+        return flags, body
+
+MORE = object()  # MessageAssembler.push: message not complete yet
+
+class MessageAssembler():
+    """Turns frames into messages: decodes plain frames and reassembles
+    json streams. Raw streams are handed back as their header (plus "sid")
+    and their chunks must be drained by the caller (iter_stream). Bodies
+    using a codec or compression the hello didn't agree on are rejected."""
+    def __init__(self):
+        self.zstats = ZStats()
+        self.accept = 0  # FLAG_MSGPACK / FLAG_ZLIB allowed, see allow()
+        self._sid = None
+        self._flags = 0
+        self._data = None
+        self.raw_sid = None  # set when push() returned a raw stream header
+
+    def push(self, flags: int, body):
+        if body is None:
+            if self._sid is not None:
+                raise ProtocolError(f"stream {self._sid}: oversized frame inside stream")
+            return {}
+        if not flags & FLAG_STREAM:
+            if self._sid is not None:
+                raise ProtocolError(f"stream {self._sid}: unexpected frame inside stream")
+            return self.decode(flags, body)
+        kind, sid = STREAM_HDR.unpack_from(body)
+        if kind == STREAM_BEGIN:
+            if self._sid is not None:
+                raise ProtocolError(f"stream {self._sid}: nested stream {sid}")
+            header = json.loads(str(body[STREAM_HDR.size:], "utf-8"))
+            if not header.get("json"):
+                header["sid"] = sid
+                self.raw_sid = sid
+                return header
+            self._sid, self._flags, self._data = sid, flags & ~FLAG_STREAM, bytearray()
+            return MORE
+        if sid != self._sid:
+            raise ProtocolError(f"stream {self._sid}: got chunk of stream {sid}")
+        if kind == STREAM_CHUNK:
+            self._data += body[STREAM_HDR.size:]
+            return MORE
+        data, flags = self._data, self._flags
+        self._sid, self._data = None, None
+        return self.decode(flags, data)
+
+    def allow(self, codec: str, compress_min):
+        # what the hello agreed on
+        self.accept = accepted_flags(codec, compress_min)
+
+    def check(self, flags: int):
+        bad = flags & (FLAG_MSGPACK | FLAG_ZLIB) & ~self.accept
+        if bad:
+            raise ProtocolError(f"frame flags {bad:#x} were not negotiated")
+
+    def decode(self, flags: int, body):
+        self.check(flags)
+        if flags & FLAG_ZLIB:
+            wire = len(body)
+            body = inflate(body)
+            flags &= ~FLAG_ZLIB
+            self.zstats.count_in(FLAG_ZLIB, len(body), wire)
+            ZSTATS_TOTAL.count_in(FLAG_ZLIB, len(body), wire)
+        else:
+            self.zstats.count_in(flags, len(body), len(body))
+            ZSTATS_TOTAL.count_in(flags, len(body), len(body))
+        return decode(flags, body)
+
+    def stream_chunk(self, sid: int, flags: int, body):
+        # -> payload of a raw stream CHUNK frame, or None at END
+        if body is None or not flags & FLAG_STREAM:
+            raise ProtocolError(f"stream {sid}: unexpected frame inside stream")
+        kind, got = STREAM_HDR.unpack_from(body)
+        if got != sid:
+            raise ProtocolError(f"stream {sid}: got chunk of stream {got}")
+        if kind == STREAM_END:
+            return None
+        self.check(flags)
+        data = body[STREAM_HDR.size:]
+        if self.accept & FLAG_ZLIB:
+            # counted like stream_frames does: only where zlib was agreed on
+            wire = len(data)
+            if flags & FLAG_ZLIB:
+                data = inflate(data)
+            self.zstats.count_in(flags & FLAG_ZLIB, len(data), wire)
+            ZSTATS_TOTAL.count_in(flags & FLAG_ZLIB, len(data), wire)
+        return data
+
+# === wire frames (shared with TCP_async) === #
+def stream_frames(header: dict, chunks, flags: int = 0, compress_min=None, zstats: ZStats = None):
+    """Yield the wire buffers of one stream carrying `chunks` (iterable of
+    bytes), split to fit MAX_FRAME. A chunk frame is two buffers, its
+    headers and a view of the payload, so the data is never copied and
+    `chunks` is only pulled as the frames are consumed. The receiver sees
+    `header` (plus "sid") from recv_json, then reads the data with
+    iter_stream(sid).
+    With `compress_min` (negotiated on the connection) each chunk frame is
+    compressed on its own like a message body (FLAG_ZLIB on that frame)."""
+    sid = next(_stream_ids)
+    step = MAX_FRAME - STREAM_HDR.size
+    flag = FLAG_STREAM << 24
+    meta = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    body = STREAM_HDR.pack(STREAM_BEGIN, sid) + meta
+    yield HDR.pack((FLAG_STREAM | flags) << 24 | len(body)) + body
+    for chunk in chunks:
+        view = memoryview(chunk)
+        for i in range(0, len(view), step):
+            piece = view[i:i + step]
+            zflag, body = compress(0, piece, compress_min)
+            if compress_min is not None:
+                ZSTATS_TOTAL.count_out(zflag, len(piece), len(body))
+                if zstats is not None:
+                    zstats.count_out(zflag, len(piece), len(body))
+            yield HDR.pack(flag | zflag << 24 | (STREAM_HDR.size + len(body))) + STREAM_HDR.pack(STREAM_CHUNK, sid)
+            yield body
+    yield HDR.pack(flag | STREAM_HDR.size) + STREAM_HDR.pack(STREAM_END, sid)
+
+class Preencoded():
+    """A message that is sent many times unchanged (e.g. a DB snapshot):
+    encoded and compressed once per (codec, compression) setting, then
+    reused by every send. Pass it anywhere a message dict goes."""
+    __slots__ = ("obj", "_cache")
+    def __init__(self, obj):
+        self.obj = obj
+        self._cache = {}
+
+    def encoded(self, codec: str = "json", compress_min=None):
+        key = (codec, compress_min)
+        enc = self._cache.get(key)
+        if enc is None:
+            flags, body = encode(self.obj, codec)
+            raw = len(body)
+            flags, body = compress(flags, body, compress_min)
+            enc = self._cache[key] = (flags, raw, body)
+        ZSTATS_TOTAL.count_out(enc[0], enc[1], len(enc[2]))
+        return enc
+
+def encode_message(obj, codec: str = "json", compress_min=None):
+    # -> (flags, raw body size, body on the wire)
+    if isinstance(obj, Preencoded):
+        return obj.encoded(codec, compress_min)
+    flags, body = encode(obj, codec)
+    raw = len(body)
+    flags, body = compress(flags, body, compress_min)
+    ZSTATS_TOTAL.count_out(flags, raw, len(body))
+    return flags, raw, body
+
+def body_frames(flags: int, body) -> list:
+    # wire buffers for an encoded body: [header, body], or a whole stream
+    # (small headers + views into body, see stream_frames)
+    if len(body) > MAX_FRAME:
+        return list(stream_frames({"json": True}, (body,), flags))
+    return [HDR.pack(flags << 24 | len(body)), body]
+
+def message_frames(obj, codec: str = "json", compress_min=None, zstats: ZStats = None) -> list:
+    """Encode one message into the list of buffers that make up its wire
+    frames (headers included): one frame, or a stream when it exceeds
+    MAX_FRAME. Ready for sendmsg / writelines."""
+    flags, raw, body = encode_message(obj, codec, compress_min)
+    if zstats is not None:
+        zstats.count_out(flags, raw, len(body))
+    return body_frames(flags, body)
+
+# === blocking socket reader === #
+class FrameReader():
+    """Per-socket reader on top of FrameBuffer: recv_into the buffer and
+    hand out whole messages."""
+    def __init__(self, sock: socket.socket, bufsize: int = 65536, max_frame: int = None):
+        self.sock = sock
+        self.buf = FrameBuffer(bufsize, max_frame)
+        self.asm = MessageAssembler()
+        self.zstats = self.asm.zstats
+        self.stats = None  # TrafficStats once instrumented
+
+    def pending(self) -> int:
+        return self.buf.pending()
+
+    def read_frame(self):
+        # -> (flags, body), see FrameBuffer.next_frame
+        while True:
+            frame = self.buf.next_frame()
+            if frame is not None:
+                return frame
+            k = self.sock.recv_into(self.buf.writable(self.buf.need()))
+            if not k:
+                raise ConnectionError("peer closed")
+            self.buf.advance(k)
+
+    def recv_json(self) -> dict:
+        if self.stats is not None:
+            return self._recv_counted()
+        while True:
+            msg = self.asm.push(*self.read_frame())
+            if msg is not MORE:
+                return msg
+
+    def _recv_counted(self) -> dict:
+        frames = nbytes = 0
+        decode_s = 0.0
+        while True:
+            flags, body = self.read_frame()
+            frames += 1
+            nbytes += HDR.size + (len(body) if body is not None else 0)
+            t0 = time.perf_counter()
+            msg = self.asm.push(flags, body)
+            decode_s += time.perf_counter() - t0
+            if msg is not MORE:
+                self.stats.add(_action(msg), frames_in=frames, bytes_in=nbytes, decode_s=decode_s)
+                return msg
+
+    def iter_stream(self, sid: int):
+        """Yield the chunks of raw stream `sid` as bytes, one frame at a time."""
+        while True:
+            chunk = self.asm.stream_chunk(sid, *self.read_frame())
+            if chunk is None:
+                return
+            yield bytes(chunk)
+
+# per-socket state: the reader, a write lock so frames written by
+# different threads (lobby fan-out) never interleave on the wire, and
+# the codec / compression agreed on in the hello handshake
+class _Conn():
+    __slots__ = ("reader", "wlock", "codec", "compress_min", "zstats", "stats")
+    def __init__(self, sock):
+        self.reader = FrameReader(sock)
+        self.wlock = threading.RLock()
+        self.codec = "json"
+        self.compress_min = None
+        self.zstats = self.reader.zstats
+        self.stats = None
+
+_conns = weakref.WeakKeyDictionary()
+_conns_lock = threading.Lock()
+
+def _conn(sock: socket.socket) -> _Conn:
+    with _conns_lock:
+        c = _conns.get(sock)
+        if c is None:
+            c = _conns[sock] = _Conn(sock)
+        return c
+
+def get_reader(sock: socket.socket) -> FrameReader:
+    # one reader per socket, so bytes buffered by one call aren't lost to the next
+    return _conn(sock).reader
+
+def configure(sock: socket.socket, codec: str = "json", compress: bool = False):
+    # set what the hello handshake would agree on, for peers configured out of band
+    _set_codec(_conn(sock), codec, COMPRESS_MIN if compress else None)
+
+def _set_codec(c: _Conn, codec: str, compress_min):
+    # what we send, and what we accept from the peer
+    c.codec, c.compress_min = codec, compress_min
+    c.reader.asm.allow(codec, compress_min)
+
+def instrument(sock: socket.socket, label: str = None, force: bool = False) -> TrafficStats:
+    """Start counting traffic on `sock` (no-op unless STATS_ENABLED or force)."""
+    if not (STATS_ENABLED or force):
+        return None
+    c = _conn(sock)
+    if c.stats is None:
+        c.stats = c.reader.stats = TrafficStats(label or repr(sock.fileno()))
+        with _conns_lock:
+            _instrumented[sock] = c.stats
+    return c.stats
+
+def stats_snapshot() -> dict:
+    """Counters of every open instrumented connection plus process-wide
+    per-action totals (which keep closed connections' traffic)."""
+    with _conns_lock:
+        live = list(_instrumented.values())
+    with _ACTION_TOTAL._lock:
+        actions = {a: dict(v) for a, v in _ACTION_TOTAL.by_action.items()}
+    return {"time": time.time(), "connections": [st.snapshot() for st in live],
+            "actions": actions, "compression": ZSTATS_TOTAL.as_dict()}
+
+def dump_stats(file=None):
+    print(json.dumps(stats_snapshot(), indent=2), file=file or sys.stderr, flush=True)
+
+def install_stats_signal(signum=None):
+    # dump_stats() to stderr on SIGUSR1 (main thread only, not on Windows)
+    import signal
+    if signum is None:
+        signum = getattr(signal, "SIGUSR1", None)
+    if signum is not None:
+        signal.signal(signum, lambda *_: dump_stats())
+
+def has_buffered(sock: socket.socket) -> bool:
+    with _conns_lock:
+        c = _conns.get(sock)
+    return c is not None and c.reader.pending() > 0
+
+# === send side === #
+IOV_MAX = 1024  # buffers per sendmsg call (Linux UIO_MAXIOV)
+
+def sendv(sock: socket.socket, bufs: list):
+    """sendall for a list of buffers: gathered into one sendmsg (writev)
+    per IOV_MAX buffers, so several frames go out in one syscall and,
+    usually, one TCP segment. Caller holds the socket's write lock."""
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(bufs))
+        return
+    bufs = [memoryview(b) for b in bufs]
+    i = 0
+    while i < len(bufs):
+        sent = sock.sendmsg(bufs[i:i + IOV_MAX])
+        # skip what went out, keep the tail of a partially sent buffer
+        while i < len(bufs) and sent >= len(bufs[i]):
+            sent -= len(bufs[i])
+            i += 1
+        if sent:
+            bufs[i] = bufs[i][sent:]
+
+def send_frame(sock: socket.socket, body: bytes, flags: int = 0):
+    with _conn(sock).wlock:
+        sendv(sock, [HDR.pack(flags << 24 | len(body)), body])
+
+STREAM_BATCH = 16  # buffers per sendmsg while streaming (8 frames, ~512 KiB)
+
+def send_stream(sock: socket.socket, header: dict, chunks, flags: int = 0):
+    """Send `chunks` (iterable of bytes) as one raw stream, see stream_frames.
+    Chunks are pulled as they are sent, so a file read with file_chunks()
+    never sits in memory as a whole."""
+    c = _conn(sock)
+    frames = stream_frames(header, chunks, flags, c.compress_min, c.zstats)
+    with c.wlock:
+        while True:
+            bufs = list(itertools.islice(frames, STREAM_BATCH))
+            if not bufs:
+                return
+            sendv(sock, bufs)
 
 def send_json(sock: socket.socket, obj: dict):
-    body = json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
-    hdr = struct.pack("!I", len(body))
-    sock.sendall(hdr + body)
+    # named for the message model; the body uses the connection's codec
+    c = _conn(sock)
+    if c.stats is not None:
+        _send_counted(sock, c, [obj])
+        return
+    frames = message_frames(obj, c.codec, c.compress_min, c.zstats)
+    with c.wlock:
+        sendv(sock, frames)
+
+def _send_counted(sock, c: _Conn, objs: list):
+    t0 = time.perf_counter()
+    frames = []
+    sizes = []
+    for obj in objs:
+        f = message_frames(obj, c.codec, c.compress_min, c.zstats)
+        frames += f
+        # [header, body] is one frame; a stream is begin + 2 buffers per chunk + end
+        sizes.append((1 if len(f) == 2 else len(f) // 2 + 1, sum(len(b) for b in f)))
+    t1 = time.perf_counter()
+    with c.wlock:
+        t2 = time.perf_counter()
+        sendv(sock, frames)
+    t3 = time.perf_counter()
+    # time waiting for the write lock counts as blocked in send
+    enc = (t1 - t0) / len(objs)
+    snd = (t3 - t1) / len(objs)
+    for obj, (nframes, nbytes) in zip(objs, sizes):
+        c.stats.add(_action(obj), frames_out=nframes, bytes_out=nbytes, encode_s=enc, send_s=snd)
+
+def send_many(sock: socket.socket, objs: list):
+    """Send several messages back to back with a single sendmsg."""
+    c = _conn(sock)
+    if c.stats is not None:
+        _send_counted(sock, c, objs)
+        return
+    frames = []
+    for obj in objs:
+        frames += message_frames(obj, c.codec, c.compress_min, c.zstats)
+    with c.wlock:
+        sendv(sock, frames)
+
+def broadcast(socks, objs: list) -> list:
+    """Send the same messages to every socket in `socks`, serializing
+    them once per (codec, compression) setting instead of once per
+    socket. One sendmsg per socket. A failing socket doesn't stop the
+    others; returns [(sock, exception), ...] for the ones that failed."""
+    encoded = {}  # (codec, compress_min) -> (buffers, [(flags, raw, wire), ...])
+    failed = []
+    for sock in socks:
+        c = _conn(sock)
+        key = (c.codec, c.compress_min)
+        if key not in encoded:
+            bufs, sizes = [], []
+            for obj in objs:
+                flags, raw, body = encode_message(obj, c.codec, c.compress_min)
+                bufs += body_frames(flags, body)
+                sizes.append((flags, raw, len(body)))
+            encoded[key] = (bufs, sizes)
+        bufs, sizes = encoded[key]
+        for flags, raw, wire in sizes:
+            c.zstats.count_out(flags, raw, wire)
+        try:
+            t0 = time.perf_counter()
+            with c.wlock:
+                sendv(sock, bufs)
+            if c.stats is not None:
+                snd = (time.perf_counter() - t0) / len(objs)
+                for obj, (flags, raw, wire) in zip(objs, sizes):
+                    c.stats.add(_action(obj), frames_out=1, bytes_out=HDR.size + wire, send_s=snd)
+        except OSError as e:
+            failed.append((sock, e))
+    return failed
 
 def recv_json(sock: socket.socket) -> dict:
-    n = struct.unpack("!I", recvn(sock, 4))[0]
-    # print server msg
-    if n > 65536:
-        return {}
-    return json.loads(recvn(sock, n).decode("utf-8"))
\ No newline at end of file
+    return get_reader(sock).recv_json()
+
+# === files as raw streams === #
+# A message with "streams": n is followed by n raw streams, one per file,
+# header {"file": name}. Game uploads / downloads use it so a file goes
+# over the wire a chunk at a time instead of inside one json body.
+FILE_CHUNK = MAX_FRAME - STREAM_HDR.size  # one frame per read
+
+def file_chunks(path, size: int = FILE_CHUNK):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+def send_files(sock: socket.socket, msg: dict, paths: dict):
+    """Send `msg` followed by the files in `paths` ({name: path}). The
+    write lock is held throughout, so no push lands between them."""
+    with _conn(sock).wlock:
+        send_json(sock, dict(msg, streams=len(paths)))
+        for name, path in paths.items():
+            send_stream(sock, {"file": name}, file_chunks(path))
+
+def recv_streams(reader: FrameReader, n: int, sink=None):
+    """Read the `n` raw streams that follow a message. sink(header, chunks)
+    gets each one (None = drop them); whatever it leaves unread is
+    drained. Returns the first exception a sink raised, or None; errors
+    of the connection itself are raised."""
+    error = None
+    for _ in range(n):
+        header = reader.recv_json()
+        if not isinstance(header, dict) or "sid" not in header:
+            raise ProtocolError(f"expected a stream, got {header!r:.80}")
+        chunks = reader.iter_stream(header["sid"])
+        if sink is not None and error is None:
+            try:
+                sink(header, chunks)
+            except ConnectionError:
+                raise
+            except Exception as e:
+                error = e
+        for _ in chunks:
+            pass
+    return error
+
+def file_sink(dest_dir):
+    """A recv_streams sink writing each file into `dest_dir` (created on
+    the first file), one chunk at a time."""
+    def sink(header: dict, chunks):
+        name = header.get("file")
+        if not isinstance(name, str) or name in ("", ".", "..") or os.path.basename(name) != name:
+            raise ValueError(f"bad file name {name!r}")
+        os.makedirs(dest_dir, exist_ok=True)
+        with open(os.path.join(dest_dir, name), "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    return sink
+
+def compression_stats(sock: socket.socket = None) -> dict:
+    if sock is None:
+        return ZSTATS_TOTAL.as_dict()
+    return _conn(sock).zstats.as_dict()
+
+# === hello handshake === #
+# client -> {"__hello__": {"codecs": [...], "compress": ["zlib"]}}
+# server -> {"__hello__": {"codec": c, "compress": "zlib" or null}}
+# Both hellos are plain json. A client may pipeline its first request
+# right after send_hello and read the answer with recv_hello. msgpack is
+# only offered when the optional msgpack package is installed (CODECS), so
+# by default the handshake settles on json and only compression changes.
+def hello_offer(codecs: list = None, compress: bool = True) -> dict:
+    hello = {"codecs": CODECS if codecs is None else codecs}
+    if compress:
+        hello["compress"] = ["zlib"]
+    return {"__hello__": hello}
+
+def hello_answer(req: dict, codecs: list = None, compress: bool = True) -> dict:
+    # server side: pick the client's first codec we can use
+    hello = req["__hello__"]
+    ours = CODEC_FLAGS if codecs is None else codecs
+    codec = "json"
+    for name in hello.get("codecs", []):
+        if name in ours:
+            codec = name
+            break
+    zlib_ok = compress and "zlib" in hello.get("compress", [])
+    return {"__hello__": {"codec": codec, "compress": "zlib" if zlib_ok else None}}
+
+def hello_result(resp: dict):
+    # -> (codec, compress_min) to use for a hello answer
+    hello = resp.get("__hello__", {})
+    codec = hello.get("codec", "json")
+    if codec not in CODEC_FLAGS:
+        raise ProtocolError(f"peer picked unknown codec {codec}")
+    return codec, COMPRESS_MIN if hello.get("compress") == "zlib" else None
+
+def is_hello(req: dict) -> bool:
+    return isinstance(req, dict) and "__hello__" in req
+
+def send_hello(sock: socket.socket, codecs: list = None, compress: bool = True):
+    send_json(sock, hello_offer(codecs, compress))
+
+def recv_hello(sock: socket.socket) -> str:
+    c = _conn(sock)
+    _set_codec(c, *hello_result(recv_json(sock)))
+    return c.codec
+
+def client_hello(sock: socket.socket, codecs: list = None, compress: bool = True) -> str:
+    send_hello(sock, codecs, compress)
+    return recv_hello(sock)
+
+def server_hello(sock: socket.socket, req: dict, codecs: list = None, compress: bool = True) -> bool:
+    """Answer `req` if it is a hello and switch the connection to the
+    chosen codec/compression. Returns False (and does nothing) for normal requests."""
+    if not is_hello(req):
+        return False
+    answer = hello_answer(req, codecs, compress)
+    send_json(sock, answer)
+    _set_codec(_conn(sock), *hello_result(answer))
+    return True
+
+# === request ids / pipelining === #
+# A request may carry "req_id"; the server echoes it in the response.
+# Messages without a req_id the client is waiting for are pushes
+# (room_update, player_ready, game_start, ...).
+class Dispatcher():
+    """Client side of req_id pipelining: a reader thread owns the socket,
+    routes responses to the Future of their request and queues pushes, so
+    many requests can be in flight on one connection."""
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.pushes = queue.Queue()
+        self._ids = itertools.count(1)
+        self._waiting = {}  # req_id -> Future
+        self._sinks = {}    # req_id -> recv_streams sink for the streams of its reply
+        self._lock = threading.Lock()
+        self._error = None
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, msg: dict, sink=None) -> Future:
+        # sink: gets the files (raw streams) sent with the reply, see recv_streams
+        fut = Future()
+        rid = next(self._ids)
+        with self._lock:
+            if self._error is not None:
+                raise self._error
+            self._waiting[rid] = fut
+            if sink is not None:
+                self._sinks[rid] = sink
+        try:
+            send_json(self.sock, dict(msg, req_id=rid))
+        except OSError:
+            with self._lock:
+                self._waiting.pop(rid, None)
+                self._sinks.pop(rid, None)
+            raise
+        return fut
+
+    def request(self, msg: dict, timeout: float = None, sink=None) -> dict:
+        return self.submit(msg, sink).result(timeout)
+
+    def next_push(self, timeout: float = None):
+        # -> next push, or None on timeout / once the connection is gone
+        try:
+            return self.pushes.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _read_loop(self):
+        reader = get_reader(self.sock)
+        try:
+            while True:
+                msg = reader.recv_json()
+                rid = msg.get("req_id") if isinstance(msg, dict) else None
+                with self._lock:
+                    fut = self._waiting.pop(rid, None)
+                    sink = self._sinks.pop(rid, None)
+                error = None
+                if isinstance(msg, dict) and msg.get("streams"):
+                    # the reply is complete once its files are read
+                    error = recv_streams(reader, msg["streams"], sink)
+                if fut is None:
+                    self.pushes.put(msg)
+                elif error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(msg)
+        except (ConnectionError, OSError, ValueError) as e:
+            with self._lock:
+                self._error = e if isinstance(e, ConnectionError) else ConnectionError(str(e))
+                waiting, self._waiting = self._waiting, {}
+                self._sinks = {}
+            for fut in waiting.values():
+                fut.set_exception(self._error)
+            self.pushes.put(None)
@@ -0,0 +1,134 @@
+import socket, json, struct, threading, weakref
+from typing import Dict, Any, Optional
+
+# Framed json connection for game servers / clients (the games under
+# Developer/game_local and the store). Games speak their own protocol, not
+# TCP_tool's: by default one json object per line ("line" mode), so old game
+# builds still talk to new ones. "length" mode uses a 4-byte big-endian
+# length prefix instead; both ends must pick the same mode.
+#
+# Unlike the copy-pasted recv_json of the old templates the read buffer
+# lives with the connection, so several messages arriving in one recv()
+# (snake "state" + "game_over", fast "dir" presses) are all delivered.
+LINE = "line"
+LENGTH = "length"
+MAX_MSG = 1 << 20      # longest line / frame accepted
+_LEN = struct.Struct("!I")
+
+class GameConn():
+    def __init__(self, sock: socket.socket, mode: str = LINE, bufsize: int = 65536):
+        if mode not in (LINE, LENGTH):
+            raise ValueError(f"unknown mode {mode!r}")
+        self.sock = sock
+        self.mode = mode
+        self.bufsize = bufsize
+        self._buf = bytearray()
+        self._pos = 0          # start of unread data in _buf
+        self._rlock = threading.Lock()
+        self._wlock = threading.Lock()
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def pending(self) -> bool:
+        # a whole message is already buffered (select() won't report it)
+        return self._next(peek=True) is not None
+
+    def send(self, obj: Dict[str, Any]) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        if self.mode == LINE:
+            data += b"\n"
+        else:
+            data = _LEN.pack(len(data)) + data
+        with self._wlock:
+            self.sock.sendall(data)
+
+    def recv(self) -> Optional[Dict[str, Any]]:
+        """Next message, or None once the peer closed / sent garbage."""
+        with self._rlock:
+            while True:
+                try:
+                    body = self._next()
+                except ConnectionError:
+                    return None
+                if body is not None:
+                    try:
+                        return json.loads(body)
+                    except (json.JSONDecodeError, UnicodeDecodeError):
+                        return None
+                try:
+                    chunk = self.sock.recv(self.bufsize)
+                except OSError:
+                    return None
+                if not chunk:
+                    return None
+                if self._pos:
+                    # drop what was already parsed before growing the buffer
+                    del self._buf[:self._pos]
+                    self._pos = 0
+                self._buf += chunk
+
+    def recv_all(self) -> list:
+        # every message already buffered, without blocking
+        out = []
+        with self._rlock:
+            while True:
+                try:
+                    body = self._next()
+                except ConnectionError:
+                    return out
+                if body is None:
+                    return out
+                try:
+                    out.append(json.loads(body))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    return out
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _next(self, peek: bool = False):
+        # cut one message body out of the buffer, None if incomplete
+        buf, pos = self._buf, self._pos
+        if self.mode == LINE:
+            end = buf.find(b"\n", pos)
+            if end < 0:
+                if len(buf) - pos > MAX_MSG:
+                    raise ConnectionError("line too long")
+                return None
+            if not peek:
+                self._pos = end + 1
+            return bytes(buf[pos:end])
+        if len(buf) - pos < _LEN.size:
+            return None
+        n = _LEN.unpack_from(buf, pos)[0]
+        if n > MAX_MSG:
+            raise ConnectionError(f"frame too large ({n} bytes)")
+        if len(buf) - pos - _LEN.size < n:
+            return None
+        end = pos + _LEN.size + n
+        if not peek:
+            self._pos = end
+        return bytes(buf[pos + _LEN.size:end])
+
+# === drop-in send_json / recv_json(sock) for the game scripts === #
+_conns = weakref.WeakKeyDictionary()
+_conns_lock = threading.Lock()
+
+def get_conn(sock: socket.socket, mode: str = LINE) -> GameConn:
+    # the GameConn (and its buffer) that belongs to `sock`; mode only counts the first time
+    with _conns_lock:
+        c = _conns.get(sock)
+        if c is None:
+            c = _conns[sock] = GameConn(sock, mode)
+        return c
+
+def send_json(conn: socket.socket, obj: Dict[str, Any]) -> None:
+    get_conn(conn).send(obj)
+
+def recv_json(conn: socket.socket) -> Optional[Dict[str, Any]]:
+    return get_conn(conn).recv()
@@ -0,0 +1,173 @@
+import struct
+import json
+
+# Small MessagePack codec (nil/bool/int/float/str/bin/array/map), used as
+# the binary body format of TCP_tool when both ends agree on it.
+# If the `msgpack` package is installed its C implementation is used instead.
+try:
+    import msgpack as _msgpack
+except ImportError:
+    _msgpack = None
+
+HAVE_FAST = _msgpack is not None
+
+_pack_f64 = struct.Struct(">d").pack
+_unpack_f64 = struct.Struct(">d").unpack_from
+
+def _key(k) -> str:
+    # same key coercion as json.dumps, so both codecs give the same dict back
+    return k if isinstance(k, str) else json.dumps(k)
+
+def _pack(obj, out: bytearray):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj >= 0:
+            if obj <= 0xff:
+                out += b"\xcc" + struct.pack(">B", obj)
+            elif obj <= 0xffff:
+                out += b"\xcd" + struct.pack(">H", obj)
+            elif obj <= 0xffffffff:
+                out += b"\xce" + struct.pack(">I", obj)
+            else:
+                out += b"\xcf" + struct.pack(">Q", obj)
+        else:
+            if obj >= -0x80:
+                out += b"\xd0" + struct.pack(">b", obj)
+            elif obj >= -0x8000:
+                out += b"\xd1" + struct.pack(">h", obj)
+            elif obj >= -0x80000000:
+                out += b"\xd2" + struct.pack(">i", obj)
+            else:
+                out += b"\xd3" + struct.pack(">q", obj)
+    elif isinstance(obj, float):
+        out += b"\xcb" + _pack_f64(obj)
+    elif isinstance(obj, str):
+        b = obj.encode("utf-8")
+        n = len(b)
+        if n < 32:
+            out.append(0xa0 | n)
+        elif n <= 0xff:
+            out += b"\xd9" + struct.pack(">B", n)
+        elif n <= 0xffff:
+            out += b"\xda" + struct.pack(">H", n)
+        else:
+            out += b"\xdb" + struct.pack(">I", n)
+        out += b
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        n = len(obj)
+        if n <= 0xff:
+            out += b"\xc4" + struct.pack(">B", n)
+        elif n <= 0xffff:
+            out += b"\xc5" + struct.pack(">H", n)
+        else:
+            out += b"\xc6" + struct.pack(">I", n)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(0x90 | n)
+        elif n <= 0xffff:
+            out += b"\xdc" + struct.pack(">H", n)
+        else:
+            out += b"\xdd" + struct.pack(">I", n)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(0x80 | n)
+        elif n <= 0xffff:
+            out += b"\xde" + struct.pack(">H", n)
+        else:
+            out += b"\xdf" + struct.pack(">I", n)
+        for k, v in obj.items():
+            _pack(_key(k), out)
+            _pack(v, out)
+    else:
+        raise TypeError(f"cannot msgpack {type(obj).__name__}")
+
+# (struct format, size) for the fixed-width scalar type bytes
+_FIXED = {
+    0xcc: (">B", 1), 0xcd: (">H", 2), 0xce: (">I", 4), 0xcf: (">Q", 8),
+    0xd0: (">b", 1), 0xd1: (">h", 2), 0xd2: (">i", 4), 0xd3: (">q", 8),
+    0xca: (">f", 4), 0xcb: (">d", 8),
+}
+_LEN = {0xc4: 1, 0xc5: 2, 0xc6: 4, 0xd9: 1, 0xda: 2, 0xdb: 4,
+        0xdc: 2, 0xdd: 4, 0xde: 2, 0xdf: 4}
+_LEN_FMT = {1: ">B", 2: ">H", 4: ">I"}
+
+def _unpack(buf, pos: int):
+    t = buf[pos]
+    pos += 1
+    if t < 0x80:
+        return t, pos
+    if t >= 0xe0:
+        return t - 0x100, pos
+    if 0xa0 <= t <= 0xbf:
+        n = t & 0x1f
+        return str(buf[pos:pos + n], "utf-8"), pos + n
+    if 0x90 <= t <= 0x9f:
+        return _unpack_array(buf, pos, t & 0x0f)
+    if 0x80 <= t <= 0x8f:
+        return _unpack_map(buf, pos, t & 0x0f)
+    if t == 0xc0:
+        return None, pos
+    if t == 0xc2:
+        return False, pos
+    if t == 0xc3:
+        return True, pos
+    if t in _FIXED:
+        fmt, size = _FIXED[t]
+        return struct.unpack_from(fmt, buf, pos)[0], pos + size
+    if t in _LEN:
+        size = _LEN[t]
+        n = struct.unpack_from(_LEN_FMT[size], buf, pos)[0]
+        pos += size
+        if t in (0xc4, 0xc5, 0xc6):
+            return bytes(buf[pos:pos + n]), pos + n
+        if t in (0xd9, 0xda, 0xdb):
+            return str(buf[pos:pos + n], "utf-8"), pos + n
+        if t in (0xdc, 0xdd):
+            return _unpack_array(buf, pos, n)
+        return _unpack_map(buf, pos, n)
+    raise ValueError(f"unsupported msgpack type byte 0x{t:02x}")
+
+def _unpack_array(buf, pos, n):
+    items = []
+    for _ in range(n):
+        item, pos = _unpack(buf, pos)
+        items.append(item)
+    return items, pos
+
+def _unpack_map(buf, pos, n):
+    d = {}
+    for _ in range(n):
+        k, pos = _unpack(buf, pos)
+        v, pos = _unpack(buf, pos)
+        d[k] = v
+    return d, pos
+
+def packb(obj) -> bytes:
+    if _msgpack is not None:
+        return _msgpack.packb(obj, use_bin_type=True)
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+def unpackb(data):
+    if _msgpack is not None:
+        return _msgpack.unpackb(data, raw=False, strict_map_key=False)
+    view = memoryview(data)
+    obj, pos = _unpack(view, 0)
+    if pos != len(view):
+        raise ValueError("trailing bytes after msgpack object")
+    return obj